@@ -9,12 +9,16 @@ from channels.security.websocket import AllowedHostsOriginValidator
 
 from chats import routing
 from chats.middleware import WebSocketJWTAuthMiddleware
+from users import routing as users_routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AllowedHostsOriginValidator(
-        WebSocketJWTAuthMiddleware(URLRouter(routing.websocket_urlpatterns))
+        WebSocketJWTAuthMiddleware(URLRouter(
+            routing.websocket_urlpatterns +
+            users_routing.websocket_urlpatterns
+        ))
     )
 })
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.sites',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'django_filters',
     'djoser',
@@ -103,13 +104,35 @@ TEMPLATES = [
     },
 ]
 
+# Память процесса перед общим Redis. В тестах общий уровень
+# можно заменить на django.core.cache.backends.locmem.LocMemCache
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': (BASE_DIR / 'cache'),
-    }
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'SHARED_CACHE': 'shared',
+            'MAX_ENTRIES': 10000,
+            'LOCAL_TIMEOUT': int(os.getenv('CACHE_LOCAL_TIMEOUT', default=2)),
+        },
+    },
+    # Без Redis общий кэш живёт в памяти процесса: подходит для
+    # разработки и одного процесса, но не для нескольких воркеров
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    } if CACHE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
 }
 
+# Количество потоков для фоновых задач (уменьшенные копии изображений,
+# голосовые сообщения). Рассылка outbox идёт в своём потоке
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', default=2))
+
 WSGI_APPLICATION = 'backend.wsgi.application'
 ASGI_APPLICATION = 'backend.asgi.application'
 
@@ -179,7 +202,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.SnapshotJWTAuthentication',
     ],
 
     'DEFAULT_FILTER_BACKENDS': [
@@ -245,6 +268,11 @@ if not DEBUG:
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Внутренний location nginx, которому передаётся отдача файлов чатов.
+# Если не задан, файлы отдаёт Django (только для разработки)
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv(
+    'MEDIA_ACCEL_REDIRECT_PREFIX', default=''
+)
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.getenv("EMAIL_HOST")
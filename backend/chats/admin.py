@@ -38,8 +38,18 @@ class GroupChatAdmin(ChatAdmin):
     display_members.short_description = 'Участники'
 
     
+class AttachmentAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'size', 'content_hash', 'message')
+    list_select_related = ('message',)
+    exclude = ('content',)
+
+    def get_queryset(self, request):
+        # Содержимое старых вложений в БД не загружаем
+        return super().get_queryset(request).defer('content')
+
+
 admin.site.register(Chat, ChatAdmin)
-admin.site.register(Attachment)
+admin.site.register(Attachment, AttachmentAdmin)
 admin.site.register(Message)
 admin.site.register(PersonalChat, PersonalChatAdmin)
 admin.site.register(GroupChat, GroupChatAdmin)
@@ -7,3 +7,6 @@ class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
     verbose_name = 'Приложение для описания чатов и сообщений'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,15 +1,24 @@
 # import base64
+import asyncio
 import json
+import time
 
 # from django.core.files.base import ContentFile
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from channels.db import database_sync_to_async
+from rest_framework.exceptions import APIException
 
-from .models import Message, PersonalChat
-from .serializers import MessageSerializer
+from core.constants import TYPING_THROTTLE_INTERVAL, TYPING_TIMEOUT
+from core.consumers import PingingWebsocketConsumer
+
+from .events import get_user_group_name, send_chat_event
+from .models import PersonalChat
+from .serializers import (ChatSyncParamsSerializer, ChatSyncSerializer,
+                          MessageSerializer)
+from .services import send_message
 
 # import secrets
 # from datetime import datetime
@@ -17,98 +26,263 @@ from .serializers import MessageSerializer
 User = get_user_model()
 
 
-class ChatConsumer(WebsocketConsumer):
-    def connect(self):
+class UserConsumer(PingingWebsocketConsumer):
+    """
+    Одно подключение пользователя для всех его чатов: ws/user/.
+    Подключение входит в группу user_<id>, события чатов приходят
+    с chat_id, входящие кадры указывают chat_id своего чата.
+    Работа с БД собрана в отдельные синхронные методы,
+    каждый из которых выполняется одним вызовом database_sync_to_async.
+    События набора текста идут только через channel layer.
+    Кадр сообщения может содержать client_id: повтор с тем же
+    ключом не создаёт сообщение, исходное возвращается только
+    отправившему подключению. Клиент отвечает на кадры ping.
+    """
+
+    ping_enabled = True
+
+    async def connect(self):
         if isinstance(self.scope["user"], AnonymousUser):
-            self.close()
+            await self.close()
+            return
 
-        self.chat_id = self.scope["url_route"]["kwargs"]["chat_id"]
-        self.room_group_name = f"chat_{self.chat_id}"
+        self.user = self.scope["user"]
+        # Чаты загружаются один раз на всё время соединения
+        self.chats = {}
+        # id чата -> момент рассылки начала набора и задача его завершения
+        self.typing_sent_at = {}
+        self.typing_expiry = {}
+        if not await self.has_access():
+            await self.close()
+            return
 
-        # Join room group
-        async_to_sync(self.channel_layer.group_add)(
-            self.room_group_name, self.channel_name
-        )
-        self.accept()
+        self.group_name = get_user_group_name(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
 
-    def disconnect(self, close_code):
-        # Leave room group
-        async_to_sync(self.channel_layer.group_discard)(
-            self.room_group_name, self.channel_name
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'group_name'):
+            return
+        for chat_id in list(self.typing_sent_at):
+            await self.stop_typing(self.chats[chat_id])
+        await self.channel_layer.group_discard(
+            self.group_name, self.channel_name
         )
 
+    async def has_access(self):
+        return True
+
+    def get_frame_chat_id(self, data):
+        return data.get('chat_id')
+
+    def is_subscribed(self, event):
+        return True
+
     # Receive message from WebSocket
-    def receive(self, text_data=None, bytes_data=None):
-        # parse the json data into dictionary object
-        text_data_json = json.loads(text_data)
-        if text_data_json['type'] == 'block_user':
-            user_slug = text_data_json['user_slug']
-            blocked = text_data_json['blocked']
-
-            # Отправить уведомление о блокировке/разблокировке через WebSocket
-            async_to_sync(self.channel_layer.group_send)(
-                self.room_group_name,
-                {
+    async def receive_frame(self, text_data_json):
+        chat = await self.get_chat(self.get_frame_chat_id(text_data_json))
+        if chat is None:
+            await self.send_error('Чат не найден.')
+            return
+
+        match text_data_json.get('type'):
+            case 'typing_start':
+                await self.start_typing(chat)
+            case 'typing_stop':
+                await self.stop_typing(chat)
+            case 'sync':
+                await self.send_frame(
+                    await self.get_changes(chat, text_data_json)
+                )
+            case 'block_user':
+                # Отправить уведомление о блокировке/разблокировке
+                await send_chat_event(chat, {
                     'type': 'block_user_notification',
-                    'user_slug': user_slug,
-                    'blocked': blocked,
-                }
-            )
-
-        # Send message to room group
-        chat_type = {"type": "chat_message"}
-        return_dict = {**chat_type, **text_data_json}
-        async_to_sync(self.channel_layer.group_send)(
-            self.room_group_name,
-            return_dict,
-        )
+                    'user_slug': text_data_json['user_slug'],
+                    'blocked': text_data_json['blocked'],
+                })
+            case _:
+                await self.send_message(chat, text_data_json)
 
-    # Receive message from room group
-    def chat_message(self, event):
-        text_data_json = event.copy()
-        text_data_json.pop("type")
-        message, attachment = (
-            text_data_json["message"],
-            text_data_json.get("attachment", None),
-        )
+    async def send_message(self, chat, data):
+        if not isinstance(data.get('message'), str):
+            await self.send_error('Некорректный текст сообщения.')
+            return
+        payload, error = await self.create_message(chat, data)
+        if error is not None:
+            await self.send_error(error)
+            return
+        if payload is not None:
+            # Повтор уже сохранённого сообщения подтверждается
+            # только этому подключению
+            await self.send_frame(self.format_message({
+                'chat_id': chat.pk,
+                'payload': payload,
+            }))
+            return
+        # Собеседник завершает набор по самому сообщению
+        self.reset_typing(chat.pk)
+
+    async def get_chat(self, chat_id):
+        """Чат пользователя по id или None."""
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            return None
+        if chat_id not in self.chats:
+            chat = await self.load_chat(chat_id)
+            if chat is None:
+                return None
+            self.chats[chat_id] = chat
+        return self.chats[chat_id]
 
-        chat = PersonalChat.objects.get(id=int(self.chat_id))
-        sender = self.scope['user']
-
-        # Attachment
-        if attachment:
-            pass
-        #     file_str, file_ext = attachment["data"], attachment["format"]
-
-        #     file_data = ContentFile(
-        #         base64.b64decode(file_str),
-        #         name=f"{secrets.token_hex(8)}.{file_ext}"
-        #     )
-        #     _message = Message.objects.create(
-        #         sender=sender,
-        #         attachment=file_data,
-        #         text=message,
-        #         chat=chat,
-        #     )
-        # else:
-        _message = Message.objects.create(
-            sender=sender,
-            text=message,
-            chat=chat,
+    async def start_typing(self, chat):
+        """
+        Разослать начало набора.
+        Повторы в пределах TYPING_THROTTLE_INTERVAL только продлевают
+        набор, набор без новых событий завершается через TYPING_TIMEOUT.
+        """
+        now = time.monotonic()
+        sent_at = self.typing_sent_at.get(chat.pk)
+        throttled = (
+            sent_at is not None and
+            now - sent_at < TYPING_THROTTLE_INTERVAL
         )
-        serializer = MessageSerializer(instance=_message)
-        # Send message to WebSocket
-        self.send(
-            text_data=json.dumps(
-                serializer.data
-            )
+        expiry = self.typing_expiry.get(chat.pk)
+        if expiry is not None:
+            expiry.cancel()
+        self.typing_expiry[chat.pk] = asyncio.ensure_future(
+            self.expire_typing(chat)
+        )
+        if throttled:
+            return
+        self.typing_sent_at[chat.pk] = now
+        await self.send_typing(chat, True)
+
+    async def stop_typing(self, chat):
+        if chat.pk not in self.typing_sent_at:
+            return
+        self.reset_typing(chat.pk)
+        await self.send_typing(chat, False)
+
+    def reset_typing(self, chat_id):
+        expiry = self.typing_expiry.pop(chat_id, None)
+        if expiry is not None:
+            expiry.cancel()
+        self.typing_sent_at.pop(chat_id, None)
+
+    async def expire_typing(self, chat):
+        await asyncio.sleep(TYPING_TIMEOUT)
+        self.typing_expiry.pop(chat.pk, None)
+        await self.stop_typing(chat)
+
+    async def send_typing(self, chat, is_typing):
+        await send_chat_event(chat, {
+            'type': 'typing',
+            'user_slug': self.user.slug,
+            'sender_id': self.user.id,
+            'is_typing': is_typing,
+        })
+
+    @database_sync_to_async
+    def load_chat(self, chat_id):
+        return PersonalChat.objects.filter(
+            Q(participant_low=self.user) | Q(participant_high=self.user),
+            id=chat_id
+        ).first()
+
+    @database_sync_to_async
+    def get_changes(self, chat, data):
+        """Пропущенные сообщения и правки после номера since."""
+        params = ChatSyncParamsSerializer(data=data)
+        if not params.is_valid():
+            return json.dumps({'type': 'error', 'detail': params.errors})
+        changes = ChatSyncSerializer(
+            chat.get_changes(**params.validated_data)
+        ).data
+        return json.dumps({'type': 'sync', 'chat_id': chat.pk, **changes})
+
+    @database_sync_to_async
+    def create_message(self, chat, data):
+        """
+        Отправить сообщение через общий сервис отправки.
+        Новое сообщение рассылается участникам после сохранения.
+        Возвращает сериализованное исходное сообщение, если client_id
+        уже использован, и текст ошибки.
+        """
+        try:
+            message, created = send_message(chat, self.user, {
+                'text': data['message'],
+                'client_id': data.get('client_id'),
+            })
+        except APIException as exc:
+            return None, exc.detail
+        if created:
+            return None, None
+        return json.dumps(MessageSerializer(message).data), None
+
+    def format_message(self, event):
+        # Сообщение уже сериализовано отправителем,
+        # оборачиваем без повторного разбора JSON
+        return (
+            f'{{"type": "chat_message", "chat_id": {event["chat_id"]}, '
+            f'"message": {event["payload"]}}}'
         )
 
-    def block_user_notification(self, event):
+    # Receive message from room group
+    async def chat_message(self, event):
+        if self.is_subscribed(event):
+            await self.send_frame(self.format_message(event))
+
+    async def typing(self, event):
+        # Свой набор текста пользователю не возвращаем
+        if event['sender_id'] == self.user.id or not self.is_subscribed(
+            event
+        ):
+            return
+        # Пока клиент отстаёт, придержанное событие набора заменяется новым
+        await self.send_frame(json.dumps({
+            'type': 'typing',
+            'chat_id': event['chat_id'],
+            'user_slug': event['user_slug'],
+            'is_typing': event['is_typing'],
+            'timeout': TYPING_TIMEOUT,
+        }), coalesce_key=('typing', event['chat_id'], event['user_slug']))
+
+    async def block_user_notification(self, event):
+        if not self.is_subscribed(event):
+            return
         user_slug = event['user_slug']
         blocked = event['blocked']
-        self.send(text_data=json.dumps({
+        await self.send_frame(json.dumps({
             'type': 'block_user',
+            'chat_id': event['chat_id'],
             'user_slug': user_slug,
             'blocked': blocked
-        }))
+        }), coalesce_key=('block_user', event['chat_id'], user_slug))
+
+
+class ChatConsumer(UserConsumer):
+    """
+    Подключение к одному чату: ws/chats/<chat_id>.
+    Оставлено для старых клиентов. Входит в ту же группу пользователя
+    и пропускает события других чатов. Кадры ping старым клиентам
+    не отправляются.
+    """
+
+    ping_enabled = False
+
+    async def has_access(self):
+        self.chat = await self.get_chat(
+            self.scope["url_route"]["kwargs"]["chat_id"]
+        )
+        return self.chat is not None
+
+    def get_frame_chat_id(self, data):
+        return self.chat.pk
+
+    def is_subscribed(self, event):
+        return event['chat_id'] == self.chat.pk
+
+    def format_message(self, event):
+        return event['payload']
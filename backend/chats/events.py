@@ -0,0 +1,177 @@
+"""
+Рассылка событий чатов.
+События отправляются в группы участников user_<id>, а не в группы
+чатов: одно подключение пользователя получает события всех его чатов.
+
+Синхронный код (REST view) не обращается к channel layer сам:
+publish_chat_event записывает событие в outbox в текущей транзакции,
+а после фиксации dispatch_outbox рассылает накопленные события
+партиями в отдельном потоке. Откаченная транзакция событий не оставляет,
+недоступный channel layer не задерживает запрос.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+
+from django.db import transaction
+from django.utils import timezone
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from core.constants import (OUTBOX_BATCH_SIZE, OUTBOX_CLAIM_TIMEOUT,
+                            OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY)
+from core.tasks import run_task
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Флаг выставлен, пока рассылка ждёт в очереди потока:
+# фиксации, пришедшие до её начала, не ставят новых проходов
+dispatch_requested = threading.Event()
+
+
+@lru_cache(maxsize=None)
+def get_dispatch_executor():
+    """
+    Рассылка в процессе идёт в одном своём потоке: порядок событий
+    не нарушается, а долгие задачи общего пула фоновых задач
+    (копии изображений, ffmpeg) её не задерживают.
+    """
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+
+
+def get_user_group_name(user_id):
+    """Группа channel layer всех подключений пользователя."""
+    return f'user_{user_id}'
+
+
+def get_recipient_ids(chat):
+    return {
+        user_id for user_id in (chat.initiator_id, chat.receiver_id)
+        if user_id is not None
+    }
+
+
+async def send_chat_event(chat, event):
+    """Разослать событие чата участникам, событие получает chat_id."""
+    channel_layer = get_channel_layer()
+    event = {**event, 'chat_id': chat.pk}
+    for user_id in get_recipient_ids(chat):
+        await channel_layer.group_send(get_user_group_name(user_id), event)
+
+
+def publish_chat_events(chat, events):
+    """
+    Записать события чата в outbox одним запросом. События будут
+    разосланы участникам после фиксации текущей транзакции.
+    """
+    groups = [
+        get_user_group_name(user_id) for user_id in get_recipient_ids(chat)
+    ]
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(groups=groups, event={**event, 'chat_id': chat.pk})
+        for event in events
+    ])
+    transaction.on_commit(request_dispatch)
+
+
+def publish_chat_event(chat, event):
+    """Записать в outbox одно событие чата."""
+    publish_chat_events(chat, [event])
+
+
+async def send_events(events):
+    """
+    Разослать события по порядку.
+    Возвращает количество отправленных до первой ошибки.
+    """
+    channel_layer = get_channel_layer()
+    for sent, outbox_event in enumerate(events):
+        try:
+            for group in outbox_event.groups:
+                await channel_layer.group_send(group, outbox_event.event)
+        except Exception:
+            logger.exception('Outbox event %s was not sent', outbox_event.pk)
+            return sent
+    return len(events)
+
+
+def postpone_events(events):
+    """Отложить неотправленные события, исчерпавшие попытки удалить."""
+    now = timezone.now()
+    expired = []
+    for outbox_event in events:
+        outbox_event.attempts += 1
+        outbox_event.available_at = now + timedelta(
+            seconds=OUTBOX_RETRY_DELAY * outbox_event.attempts
+        )
+        if outbox_event.attempts >= OUTBOX_MAX_ATTEMPTS:
+            expired.append(outbox_event.pk)
+    if expired:
+        logger.warning('Dropping %s outbox events', len(expired))
+        OutboxEvent.objects.filter(pk__in=expired).delete()
+    OutboxEvent.objects.bulk_update(
+        [e for e in events if e.pk not in expired],
+        ['attempts', 'available_at'],
+    )
+
+
+def dispatch_batch(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Разослать одну партию готовых событий.
+    Возвращает количество отправленных и признак ошибки.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # Партии, занятые другим процессом, пропускаем
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(available_at__lte=now)
+            .order_by('pk')[:batch_size]
+        )
+        if not events:
+            return 0, False
+        # Партия занимается до фиксации, рассылка идёт вне транзакции:
+        # другие процессы её не возьмут, а события процесса,
+        # упавшего во время рассылки, станут доступны снова
+        OutboxEvent.objects.filter(pk__in=[e.pk for e in events]).update(
+            available_at=now + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)
+        )
+    sent = async_to_sync(send_events)(events)
+    OutboxEvent.objects.filter(pk__in=[e.pk for e in events[:sent]]).delete()
+    # Следующие за ошибкой события откладываются вместе с ней,
+    # чтобы участники получили их в исходном порядке
+    if sent < len(events):
+        postpone_events(events[sent:])
+        return sent, True
+    return sent, False
+
+
+def dispatch_pending(batch_size=OUTBOX_BATCH_SIZE):
+    """Разослать все готовые события. Возвращает количество отправленных."""
+    total = 0
+    while True:
+        sent, failed = dispatch_batch(batch_size)
+        total += sent
+        if failed or sent < batch_size:
+            return total
+
+
+def dispatch_outbox():
+    """Рассылка outbox в потоке рассылки."""
+    # Флаг снимается до прохода: события, зафиксированные
+    # во время рассылки, поставят следующий проход
+    dispatch_requested.clear()
+    dispatch_pending()
+
+
+def request_dispatch():
+    """Поставить рассылку outbox после фиксации транзакции."""
+    if not dispatch_requested.is_set():
+        dispatch_requested.set()
+        get_dispatch_executor().submit(run_task, dispatch_outbox, (), {})
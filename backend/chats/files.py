@@ -0,0 +1,120 @@
+"""Работа с файлами приложения chats."""
+
+import hashlib
+import os
+import re
+import secrets
+
+from django.conf import settings
+from django.core.files import File
+
+from core.constants import FILE_CHUNK_SIZE
+
+
+class HashedFile(File):
+    """
+    Файл, который считает SHA-256 и размер содержимого
+    по мере чтения фиксированными частями.
+    """
+
+    def __init__(self, file, name=None):
+        super().__init__(file, name)
+        self.sha256 = hashlib.sha256()
+        self.read_size = 0
+
+    def chunks(self, chunk_size=None):
+        for chunk in super().chunks(chunk_size or FILE_CHUNK_SIZE):
+            self.sha256.update(chunk)
+            self.read_size += len(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def get_stored_file_path(instance, filename):
+    """
+    Путь файла в хранилище по хешу содержимого.
+    Случайный суффикс не даёт удалению старой записи
+    задеть файл новой записи с тем же содержимым.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return (
+        f'files/{instance.sha256[:2]}/'
+        f'{instance.sha256}_{secrets.token_hex(4)}{extension}'
+    )
+
+
+def get_upload_path(upload_id):
+    """Путь файла, собираемого при загрузке по частям."""
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', f'{upload_id}.part')
+
+
+def write_chunk(path, offset, chunk):
+    """
+    Записать часть файла с позиции offset, отбросив всё после неё.
+    Часть пишется потоком, без чтения целиком в память.
+    Возвращает SHA-256 и размер записанной части.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    hashed_chunk = HashedFile(chunk)
+    with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b') as file:
+        file.truncate(offset)
+        file.seek(offset)
+        for data in hashed_chunk.chunks():
+            file.write(data)
+    return hashed_chunk.hexdigest(), hashed_chunk.read_size
+
+
+def truncate_file(path, size):
+    """Обрезать файл до размера size."""
+    with open(path, 'r+b') as file:
+        file.truncate(size)
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_file_etag(name, stat):
+    """
+    ETag файла. Для файлов, адресуемых по содержимому, это хеш из пути,
+    для остальных - время изменения и размер, как у nginx.
+    """
+    basename = os.path.basename(name)
+    if name.startswith('files/') and len(basename) > 64:
+        return f'"{basename[:64]}"'
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Разобрать заголовок Range с одним диапазоном.
+    Возвращает (start, end) включительно или None, если диапазон
+    не указан или не поддерживается.
+    """
+    match = RANGE_RE.match(header or '')
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def iter_file_range(path, start, end):
+    """Читать файл с позиции start по end включительно частями."""
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = file.read(min(FILE_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
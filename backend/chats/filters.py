@@ -0,0 +1,23 @@
+"""Фильтры приложения chats."""
+
+from django.db.models import F
+
+from rest_framework import filters
+
+
+class NullsLastOrderingFilter(filters.OrderingFilter):
+    """
+    Сортировка, при которой пустые значения идут последними
+    в обоих направлениях: Postgres по умолчанию ставит NULL
+    первыми при сортировке по убыванию.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        return [
+            F(field[1:]).desc(nulls_last=True) if field.startswith('-')
+            else F(field).asc(nulls_last=True)
+            for field in ordering
+        ]
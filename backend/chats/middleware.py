@@ -1,49 +1,69 @@
-from django.contrib.auth import get_user_model
+"""
+Аутентификация WebSocket-подключений по JWT.
+Токен проверяется без запросов к БД, пользователь берётся
+из снимка в кэше. Браузер не может передать заголовок,
+поэтому токен принимается также из строки запроса
+или подпротокола: new WebSocket(url, ['access_token', token]).
+"""
+
+from urllib.parse import parse_qs
+
 from django.contrib.auth.models import AnonymousUser
 
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
-from rest_framework.authtoken.models import Token
-from rest_framework_simplejwt.tokens import AccessToken, TokenError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
 
-User = get_user_model()
+from core.constants import WS_TOKEN_QUERY_PARAM, WS_TOKEN_SUBPROTOCOL
+from users.snapshot import get_user
 
 
-@database_sync_to_async
-def get_user_by_token(token_key):
-    try:
-        token = Token.objects.get(key=token_key)
-        return token.user
-    except Token.DoesNotExist:
-        return AnonymousUser()
+def get_token(scope):
+    """Токен подключения и подпротокол, которым он передан."""
+    headers = dict(scope['headers'])
+    if b'authorization' in headers:
+        parts = headers[b'authorization'].decode().split()
+        if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+            return parts[1], None
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if WS_TOKEN_QUERY_PARAM in query:
+        return query[WS_TOKEN_QUERY_PARAM][0], None
+    subprotocols = scope.get('subprotocols') or []
+    if len(subprotocols) >= 2 and subprotocols[0] == WS_TOKEN_SUBPROTOCOL:
+        return subprotocols[1], WS_TOKEN_SUBPROTOCOL
+    return None, None
 
 
-@database_sync_to_async
-def get_user_by_id(user_id):
+def get_access_token(token_key):
     try:
-        return User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        return AnonymousUser()
+        return AccessToken(token_key)
+    except TokenError:
+        return None
 
 
 class WebSocketJWTAuthMiddleware(BaseMiddleware):
 
-    def __init__(self, inner):
-        self.inner = inner
-
     async def __call__(self, scope, receive, send):
-        headers = dict(scope['headers'])
-        if b'authorization' in headers:
-            token_name, token_key = headers[b'authorization'].decode().split()
-            if token_name == 'Token':
-                scope['user'] = await get_user_by_token(token_key)
-            else:
-                try:
-                    access_token = AccessToken(token_key)
-                    scope["user"] = await get_user_by_id(
-                        access_token["user_id"]
-                    )
-                except TokenError:
-                    scope["user"] = AnonymousUser()
-        scope["user"] = AnonymousUser()
+        token_key, subprotocol = get_token(scope)
+        user = None
+        token = get_access_token(token_key) if token_key else None
+        if token is not None and api_settings.USER_ID_CLAIM in token:
+            user = await database_sync_to_async(get_user)(
+                token[api_settings.USER_ID_CLAIM], token.get('iat')
+            )
+        scope['user'] = user or AnonymousUser()
+        if subprotocol is not None:
+            send = self.accept_subprotocol(send, subprotocol)
         return await super().__call__(scope, receive, send)
+
+    def accept_subprotocol(self, send, subprotocol):
+        # Браузер разрывает подключение, если сервер не подтвердил
+        # ни один из предложенных подпротоколов
+        async def send_with_subprotocol(message):
+            is_accept = message['type'] == 'websocket.accept'
+            if is_accept and message.get('subprotocol') is None:
+                message['subprotocol'] = subprotocol
+            await send(message)
+        return send_with_subprotocol
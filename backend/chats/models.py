@@ -1,13 +1,29 @@
 """Модели для приложения chats."""
 
-from django.contrib.auth import get_user_model
-from django.db import models
+import uuid
+from functools import reduce
+from operator import add
 
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.core.files import File
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Replace
+from django.utils import timezone
+
+from django_cleanup import cleanup
 from model_utils.managers import InheritanceManager
 
-from core.constants import MAX_MESSAGE_LENGTH
+from core.constants import (CLIENT_ID_MAX_LENGTH, MAX_MESSAGE_LENGTH,
+                            MESSAGE_PREVIEW_LENGTH, SEARCH_CONFIGS,
+                            UPLOAD_KINDS)
 from core.models import DateCreatedModel, DateEditedModel
 
+from .files import (HashedFile, get_stored_file_path, get_upload_path,
+                    truncate_file, write_chunk)
+
 User = get_user_model()
 
 
@@ -27,6 +43,39 @@ class Chat(DateCreatedModel, DateEditedModel):
         blank=True,
         help_text='Список пользователей, которых вы заблокировали в этом чате.'
     )
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Последнее сообщение',
+        related_name='+'
+    )
+    last_message_at = models.DateTimeField(
+        'Время последнего сообщения',
+        null=True,
+        blank=True
+    )
+    last_message_sender = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Отправитель последнего сообщения',
+        related_name='+'
+    )
+    last_message_preview = models.CharField(
+        'Начало последнего сообщения',
+        max_length=MESSAGE_PREVIEW_LENGTH,
+        blank=True,
+        default=''
+    )
+    # Счётчик номеров сообщений и правок чата
+    last_seq = models.PositiveBigIntegerField(
+        'Последний номер изменения',
+        default=0,
+        editable=False
+    )
 
     def block_user(self, user):
         if user not in self.blocked_users.all():
@@ -39,6 +88,124 @@ class Chat(DateCreatedModel, DateEditedModel):
     def is_user_blocked(self, user):
         return user in self.blocked_users.all()
 
+    def mark_read(self, user):
+        """
+        Отметить все сообщения чата прочитанными пользователем.
+        Последнее сообщение выбирается и записывается в отметку одним
+        запросом INSERT ... SELECT ... ON CONFLICT, поэтому сообщение,
+        отправленное между выбором и записью, не считается прочитанным.
+        """
+        now = timezone.now()
+        if not connection.features.supports_update_conflicts_with_target:
+            last_message_id = Message.objects.filter(
+                chat_id=self.pk
+            ).order_by('-id').values_list('id', flat=True).first()
+            ChatReadState.objects.update_or_create(
+                chat_id=self.pk,
+                user=user,
+                defaults={
+                    'last_read_message_id': last_message_id,
+                    'last_read_at': now,
+                    'unread_count': 0,
+                },
+            )
+            return
+        qn = connection.ops.quote_name
+        state = ChatReadState._meta
+        message = Message._meta
+
+        def column(meta, name):
+            return qn(meta.get_field(name).column)
+
+        chat = column(state, 'chat')
+        reader = column(state, 'user')
+        last_read = column(state, 'last_read_message')
+        last_read_at = column(state, 'last_read_at')
+        unread_count = column(state, 'unread_count')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {qn(state.db_table)} '
+                f'({chat}, {reader}, {last_read}, {last_read_at}, '
+                f'{unread_count}) '
+                f'SELECT %s, %s, MAX({qn(message.pk.column)}), %s, 0 '
+                f'FROM {qn(message.db_table)} '
+                f'WHERE {column(message, "chat")} = %s '
+                f'ON CONFLICT ({chat}, {reader}) '
+                f'DO UPDATE SET {last_read} = EXCLUDED.{last_read}, '
+                f'{last_read_at} = EXCLUDED.{last_read_at}, '
+                f'{unread_count} = 0',
+                [
+                    self.pk,
+                    user.pk,
+                    connection.ops.adapt_datetimefield_value(now),
+                    self.pk,
+                ]
+            )
+
+    def get_read_marks(self):
+        """Словарь {id пользователя: id последнего прочитанного сообщения}."""
+        return dict(
+            self.read_states.values_list('user_id', 'last_read_message_id')
+        )
+
+    def create_read_states(self, users):
+        """Завести отметки прочтения для участников чата."""
+        ChatReadState.objects.bulk_create(
+            [
+                ChatReadState(chat_id=self.pk, user=user)
+                for user in users if user is not None
+            ],
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def allocate_seq(cls, chat_id, count=1):
+        """
+        Выделить count следующих номеров чата, вернуть последний из них.
+        Строка чата блокируется до конца транзакции, но отправка
+        сообщения и так обновляет эту строку, новой очереди нет.
+        """
+        if connection.vendor != 'postgresql':
+            cls.objects.filter(pk=chat_id).update(
+                last_seq=F('last_seq') + count
+            )
+            return cls.objects.filter(
+                pk=chat_id
+            ).values_list('last_seq', flat=True).get()
+        table = connection.ops.quote_name(cls._meta.db_table)
+        column = connection.ops.quote_name(
+            cls._meta.get_field('last_seq').column
+        )
+        pk = connection.ops.quote_name(cls._meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET {column} = {column} + %s '
+                f'WHERE {pk} = %s RETURNING {column}',
+                [count, chat_id]
+            )
+            return cursor.fetchone()[0]
+
+    def get_changes(self, since, limit):
+        """
+        Сообщения, созданные или изменённые после номера since,
+        в порядке изменений. Один запрос по индексу (chat, change_seq).
+        Сообщения ссылаются на этот же объект чата, поэтому участники
+        чата для отметок прочтения загружаются один раз.
+        """
+        last_seq = Chat.objects.filter(
+            pk=self.pk
+        ).values_list('last_seq', flat=True).get()
+        messages = list(
+            self.messages.filter(
+                change_seq__gt=since
+            ).select_related('sender').order_by('change_seq')[:limit + 1]
+        )
+        return {
+            'last_seq': last_seq,
+            'has_more': len(messages) > limit,
+            'messages': messages[:limit],
+        }
+
     objects = InheritanceManager()
 
     class Meta:
@@ -46,6 +213,14 @@ class Chat(DateCreatedModel, DateEditedModel):
         get_latest_by = 'date_created'
         verbose_name = 'Чат'
         verbose_name_plural = 'Чаты'
+        indexes = [
+            # Совпадает с сортировкой списка чатов: чаты без сообщений
+            # в конце
+            models.Index(
+                F('last_message_at').desc(nulls_last=True),
+                name='chat_last_message_at_idx'
+            ),
+        ]
 
 
 class PersonalChat(Chat):
@@ -56,16 +231,55 @@ class PersonalChat(Chat):
         null=True,
         related_name="chat_participant"
     )
+    # Участники в каноническом порядке (меньший id, больший id):
+    # пара ищется одним запросом по уникальному индексу
+    participant_low = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        editable=False,
+        related_name='+'
+    )
+    participant_high = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        editable=False,
+        related_name='+'
+    )
     # is_active = models.BooleanField(default=False)
 
     def __str__(self):
         return f'Чат между {self.initiator} и {self.receiver}'
 
+    @staticmethod
+    def get_pair_lookup(user, other_user):
+        """Условие поиска личного чата двух пользователей."""
+        low, high = sorted((user.pk, other_user.pk))
+        return {'participant_low_id': low, 'participant_high_id': high}
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and self.initiator_id and self.receiver_id:
+            self.participant_low_id, self.participant_high_id = sorted(
+                (self.initiator_id, self.receiver_id)
+            )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                self.create_read_states((self.initiator, self.receiver))
+
     class Meta:
         ordering = ['-date_created']
         get_latest_by = 'date_created'
         verbose_name = 'Личный чат'
         verbose_name_plural = 'Личные чаты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['participant_low', 'participant_high'],
+                name='unique_personal_chat_participants'
+            )
+        ]
 
     def block_user(self, user):
         if user not in [self.initiator, self.receiver]:
@@ -108,6 +322,36 @@ class GroupChat(Chat):
         verbose_name_plural = 'Групповые чаты'
 
 
+def get_search_vector():
+    """
+    Поисковый вектор текста сообщения сразу во всех конфигурациях:
+    simple находит слова любого языка как есть, языковые конфигурации
+    учитывают словоформы.
+    """
+    return reduce(add, (
+        SearchVector('text', config=config) for config in SEARCH_CONFIGS
+    ))
+
+
+def get_escaped_text():
+    """
+    Текст сообщения с экранированными символами HTML.
+    ts_headline возвращает текст как есть, поэтому сниппет строится
+    по экранированному тексту и HTML в нём - только теги подсветки.
+    Сущности вроде &lt; парсер полнотекстового поиска словами не считает.
+    """
+    text = F('text')
+    # & заменяется первым, чтобы не задеть сущности следующих замен
+    for char, entity in (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;')):
+        text = Replace(
+            text, Value(char), Value(entity),
+            output_field=models.TextField()
+        )
+    return text
+
+
+# Файлы сообщений хранятся в StoredFile и удаляются по счётчику ссылок
+@cleanup.ignore
 class Message(DateEditedModel):
     """Модель сообщения."""
 
@@ -153,6 +397,20 @@ class Message(DateEditedModel):
         verbose_name='Голосовое сообщение',
         help_text='Голосовое сообщение'
     )
+    voice_duration = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Длительность голосового сообщения',
+        help_text='Длительность голосового сообщения в секундах'
+    )
+    voice_waveform = models.BinaryField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Форма волны голосового сообщения',
+        help_text='Пики громкости голосового сообщения, байт 0-255 на пик'
+    )
     emojis = models.CharField(
         max_length=255,
         blank=True,
@@ -172,6 +430,8 @@ class Message(DateEditedModel):
         verbose_name='Сообщение отправлено',
         help_text='Сообщение отправлено'
     )
+    # Устарело: прочтение хранится в ChatReadState.
+    # Поле оставлено до переноса данных командой backfillchats.
     read_by = models.ManyToManyField(
         User,
         verbose_name='Прочитано пользователем',
@@ -187,10 +447,65 @@ class Message(DateEditedModel):
     timestamp = models.DateTimeField(
         auto_now_add=True
     )
+    seq = models.PositiveBigIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Номер в чате',
+        help_text='Номер сообщения в чате, растёт без повторов'
+    )
+    change_seq = models.PositiveBigIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Номер изменения',
+        help_text='Номер последнего изменения сообщения в чате'
+    )
+    # Повторная отправка с тем же ключом возвращает исходное сообщение
+    client_id = models.CharField(
+        max_length=CLIENT_ID_MAX_LENGTH,
+        null=True,
+        blank=True,
+        verbose_name='Ключ отправки',
+        help_text='Идентификатор сообщения на клиенте для повторных отправок'
+    )
 
-    @property
-    def is_read(self):
-        return self.read_by.exists()
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            # Сообщения и правки берут номера из одного счётчика чата,
+            # пропуск номера у клиента означает пропущенное событие.
+            # Частичное сохранение с update_fields правкой не считается
+            if adding:
+                self.seq = self.change_seq = Chat.allocate_seq(self.chat_id)
+            elif kwargs.get('update_fields') is None:
+                self.change_seq = Chat.allocate_seq(self.chat_id)
+            super().save(*args, **kwargs)
+            if adding:
+                self.update_chat_state()
+
+    def update_chat_state(self, count=1):
+        """
+        Обновить денормализованные данные чата после отправки сообщения:
+        последнее сообщение и счётчики непрочитанных участников.
+        count - сколько сообщений отправлено, включая это, последнее.
+        """
+        Chat.objects.filter(pk=self.chat_id).update(
+            last_message=self,
+            last_message_sender_id=self.sender_id,
+            last_message_at=self.timestamp,
+            last_message_preview=(self.text or '')[:MESSAGE_PREVIEW_LENGTH],
+        )
+        # Отправитель прочитал чат до своего сообщения включительно
+        ChatReadState.objects.filter(chat_id=self.chat_id).update(
+            unread_count=Case(
+                When(user_id=self.sender_id, then=Value(0)),
+                default=F('unread_count') + count,
+            ),
+            last_read_message=Case(
+                When(user_id=self.sender_id, then=Value(self.pk)),
+                default=F('last_read_message'),
+                output_field=models.BigIntegerField(),
+            ),
+        )
 
     def __str__(self):
         return (
@@ -203,8 +518,209 @@ class Message(DateEditedModel):
         get_latest_by = 'timestamp'
         verbose_name = 'Сообщение'
         verbose_name_plural = 'Сообщения'
+        indexes = [
+            models.Index(
+                fields=['chat', 'timestamp', 'id'],
+                name='message_chat_timestamp_idx'
+            ),
+            models.Index(
+                fields=['chat', 'change_seq'],
+                name='message_chat_change_seq_idx'
+            ),
+            # Поиск использует то же выражение, что и индекс
+            GinIndex(
+                get_search_vector(),
+                name='message_text_search_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['chat', 'seq'],
+                name='unique_message_chat_seq'
+            ),
+            models.UniqueConstraint(
+                fields=['sender', 'chat', 'client_id'],
+                condition=Q(client_id__isnull=False),
+                name='unique_message_sender_chat_client_id'
+            ),
+        ]
+
+
+class ChatReadState(models.Model):
+    """
+    Модель отметки прочтения чата пользователем.
+    Сообщения с id не больше last_read_message считаются прочитанными.
+    """
+
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+        verbose_name='Чат',
+        related_name='read_states'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='chat_read_states'
+    )
+    last_read_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Последнее прочитанное сообщение',
+        related_name='+'
+    )
+    last_read_at = models.DateTimeField(
+        'Время прочтения',
+        null=True,
+        blank=True
+    )
+    unread_count = models.PositiveIntegerField(
+        'Непрочитанные сообщения',
+        default=0
+    )
+
+    def __str__(self):
+        return (
+            f'{self.user} прочитал {self.chat} '
+            f'до сообщения {self.last_read_message_id}'
+        )
+
+    class Meta:
+        verbose_name = 'Отметка прочтения'
+        verbose_name_plural = 'Отметки прочтения'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['chat', 'user'],
+                name='unique_chat_read_state'
+            )
+        ]
+
+
+class StoredFileManager(models.Manager):
+    """Менеджер файлов, адресуемых по содержимому."""
+
+    def store(self, upload):
+        """
+        Сохранить файл один раз на каждое уникальное содержимое
+        и увеличить счётчик ссылок на него.
+        """
+        hashed_file = HashedFile(upload, name=upload.name)
+        for _ in hashed_file.chunks():
+            pass
+        sha256 = hashed_file.hexdigest()
+
+        while True:
+            stored_file = self.filter(sha256=sha256).first()
+            if stored_file is None:
+                stored_file = self.model(
+                    sha256=sha256,
+                    size=hashed_file.read_size,
+                    ref_count=1
+                )
+                stored_file.file.save(
+                    upload.name, File(upload, name=upload.name), save=False
+                )
+                try:
+                    with transaction.atomic():
+                        stored_file.save()
+                    return stored_file
+                except IntegrityError:
+                    # Такой же файл успели сохранить параллельно
+                    stored_file.file.delete(save=False)
+                    continue
+
+            updated = self.filter(pk=stored_file.pk).update(
+                ref_count=F('ref_count') + 1
+            )
+            if updated:
+                stored_file.ref_count += 1
+                return stored_file
+            # Файл удалили командой reclaimfiles между чтением и обновлением
+
+    def release(self, pk):
+        """
+        Уменьшить счётчик ссылок на файл. Файл без ссылок
+        удалит команда reclaimfiles.
+        """
+        self.filter(pk=pk, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1
+        )
+
+
+@cleanup.ignore
+class StoredFile(DateCreatedModel):
+    """
+    Модель файла, адресуемого по SHA-256 содержимого.
+    Одинаковые загрузки хранятся один раз. Файлы без ссылок
+    удаляются партиями командой reclaimfiles.
+    """
+
+    sha256 = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='Хеш содержимого',
+        help_text='SHA-256 содержимого файла'
+    )
+    file = models.FileField(
+        upload_to=get_stored_file_path,
+        max_length=255,
+        verbose_name='Файл',
+        help_text='Файл в хранилище'
+    )
+    size = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Размер',
+        help_text='Размер файла в байтах'
+    )
+    ref_count = models.PositiveIntegerField(
+        default=0,
+        db_index=True,
+        verbose_name='Количество ссылок',
+        help_text='Количество вложений, ссылающихся на файл'
+    )
+
+    objects = StoredFileManager()
+
+    def __str__(self):
+        return self.file.name
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+
+class AttachmentManager(models.Manager):
+    """Менеджер вложений."""
+
+    def create_from_upload(self, message, upload):
+        """
+        Сохранить загруженный файл в хранилище по частям,
+        не читая его целиком в память. Повторные загрузки
+        того же содержимого ссылаются на уже сохранённый файл.
+        """
+        return self.create_from_stored(
+            message, upload.name, StoredFile.objects.store(upload)
+        )
+
+    def create_from_stored(self, message, name, stored_file):
+        """
+        Создать вложение к уже сохранённому файлу хранилища.
+        Ссылку на файл вложение забирает у вызывающего кода.
+        """
+        return self.create(
+            name=name,
+            message=message,
+            stored_file=stored_file,
+            file=stored_file.file.name,
+            size=stored_file.size,
+            content_hash=stored_file.sha256,
+        )
 
 
+@cleanup.ignore
 class Attachment(models.Model):
     """Модель для вложений сообщений."""
 
@@ -213,7 +729,39 @@ class Attachment(models.Model):
         verbose_name='Название вложения',
         help_text='Название вложения'
     )
+    stored_file = models.ForeignKey(
+        StoredFile,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        verbose_name='Файл в хранилище',
+        related_name='attachments'
+    )
+    file = models.FileField(
+        upload_to='attachments/',
+        max_length=255,
+        blank=True,
+        db_index=True,
+        verbose_name='Файл вложения',
+        help_text='Файл вложения'
+    )
+    size = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Размер вложения',
+        help_text='Размер вложения в байтах'
+    )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name='Хеш содержимого',
+        help_text='SHA-256 содержимого вложения'
+    )
+    # Устарело: содержимое хранится в файле.
+    # Поле оставлено до переноса данных командой moveattachments.
     content = models.BinaryField(
+        null=True,
+        blank=True,
+        editable=False,
         verbose_name='Содержимое вложения',
         help_text='Содержимое вложения'
     )
@@ -224,6 +772,8 @@ class Attachment(models.Model):
         help_text='Сообщение, к которому относится вложение'
     )
 
+    objects = AttachmentManager()
+
     def __str__(self):
         return self.name
 
@@ -232,6 +782,104 @@ class Attachment(models.Model):
         verbose_name_plural = 'Вложения'
 
 
+class Upload(DateCreatedModel):
+    """
+    Модель загрузки файла по частям.
+    Файл собирается на диске, после завершения загрузки
+    его можно прикрепить к сообщению по идентификатору.
+    """
+
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False
+    )
+    owner = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Владелец',
+        related_name='uploads'
+    )
+    name = models.CharField(
+        max_length=255,
+        verbose_name='Название файла',
+        help_text='Название загружаемого файла'
+    )
+    kind = models.CharField(
+        max_length=20,
+        choices=UPLOAD_KINDS,
+        verbose_name='Тип файла',
+        help_text='Поле сообщения, в которое будет прикреплён файл'
+    )
+    size = models.PositiveBigIntegerField(
+        verbose_name='Размер',
+        help_text='Полный размер файла в байтах'
+    )
+    sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name='Хеш содержимого',
+        help_text='SHA-256 всего файла для проверки при завершении'
+    )
+    offset = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Получено байт',
+        help_text='Позиция, с которой продолжается загрузка'
+    )
+    is_complete = models.BooleanField(
+        default=False,
+        verbose_name='Загрузка завершена'
+    )
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def path(self):
+        return get_upload_path(self.pk)
+
+    def append_chunk(self, offset, chunk, checksum):
+        """
+        Дописать часть файла с позиции offset.
+        Если контрольная сумма не совпала, часть отбрасывается
+        и возвращается False.
+        """
+        digest, size = write_chunk(self.path, offset, chunk)
+        if digest != checksum.lower():
+            truncate_file(self.path, offset)
+            self.offset = offset
+            self.save(update_fields=['offset'])
+            return False
+        self.offset = offset + size
+        self.save(update_fields=['offset'])
+        return True
+
+    def finalize(self):
+        """
+        Завершить загрузку, проверив размер и хеш собранного файла.
+        Возвращает False, если файл не совпал с заявленным.
+        """
+        if self.offset != self.size:
+            return False
+        with self.open() as file:
+            hashed_file = HashedFile(file)
+            for _ in hashed_file.chunks():
+                pass
+        if self.sha256 and hashed_file.hexdigest() != self.sha256.lower():
+            return False
+        self.sha256 = hashed_file.hexdigest()
+        self.is_complete = True
+        self.save(update_fields=['sha256', 'is_complete'])
+        return True
+
+    def open(self):
+        return File(open(self.path, 'rb'), name=self.name)
+
+    class Meta:
+        verbose_name = 'Загрузка по частям'
+        verbose_name_plural = 'Загрузки по частям'
+
+
 class GroupChatRequest(DateCreatedModel):
     """Модель приглашения в групповой чат."""
 
@@ -263,3 +911,38 @@ class GroupChatRequest(DateCreatedModel):
         get_latest_by = 'date_created'
         verbose_name = 'Приглашение в групповой чат'
         verbose_name_plural = 'Приглашения в групповые чаты'
+
+
+class OutboxEvent(DateCreatedModel):
+    """
+    Событие WebSocket, ожидающее рассылки.
+    Записывается в одной транзакции с изменением данных
+    и рассылается после её фиксации, см. chats.events.
+    """
+
+    groups = models.JSONField(
+        'Группы получателей',
+        help_text='Группы channel layer, которым рассылается событие',
+    )
+    event = models.JSONField(
+        'Событие',
+        help_text='Событие channel layer',
+    )
+    attempts = models.PositiveSmallIntegerField(
+        'Попытки отправки',
+        default=0,
+    )
+    available_at = models.DateTimeField(
+        'Отправить не раньше',
+        default=timezone.now,
+        db_index=True,
+        help_text='Время следующей попытки отправки',
+    )
+
+    def __str__(self):
+        return f'{self.event.get("type")} -> {", ".join(self.groups)}'
+
+    class Meta:
+        ordering = ['pk']
+        verbose_name = 'Событие для рассылки'
+        verbose_name_plural = 'События для рассылки'
@@ -3,5 +3,6 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
+    re_path(r"ws/user/$", consumers.UserConsumer.as_asgi()),
     re_path(r"ws/chats/(?P<chat_id>\w+)", consumers.ChatConsumer.as_asgi()),
 ]
@@ -2,11 +2,17 @@
 
 
 from django.contrib.auth import get_user_model
+from django.urls import reverse
 
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
-from chats.models import GroupChat, Message, PersonalChat
-from core.constants import MAX_MESSAGE_LENGTH
+from chats.models import GroupChat, Message, PersonalChat, Upload
+from core.constants import (MAX_MESSAGE_LENGTH, PHOTO_RENDITION_SIZES,
+                            SEARCH_CONFIGS, SYNC_MAX_PAGE_SIZE, SYNC_PAGE_SIZE,
+                            UPLOAD_CHUNK_MAX_SIZE)
+from core.pagination import MessageKeysetPagination
+from core.renditions import get_renditions
 from users.serializers import UserShortSerializer
 
 from .validators import (validate_audio_extension, validate_file_size,
@@ -19,6 +25,37 @@ from .validators import (validate_audio_extension, validate_file_size,
 # from .models import Chat
 User = get_user_model()
 
+UPLOAD_EXTENSION_VALIDATORS = {
+    'file_to_send': validate_pdf_extension,
+    'photo_to_send': validate_image_extension,
+    'voice_message': validate_audio_extension,
+}
+
+
+def get_media_url(name, request=None):
+    """Ссылка на файл чата через эндпоинт с проверкой доступа к чату."""
+    url = reverse('media', kwargs={'path': name})
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+class MediaURLMixin:
+    """Ссылка на файл ведёт в эндпоинт с проверкой доступа к чату."""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return get_media_url(value.name, self.context.get('request'))
+
+
+class MediaFileField(MediaURLMixin, serializers.FileField):
+    pass
+
+
+class MediaImageField(MediaURLMixin, serializers.ImageField):
+    pass
+
 
 class MessageSerializer(serializers.ModelSerializer):
     """Сериализатор модели Message."""
@@ -28,28 +65,34 @@ class MessageSerializer(serializers.ModelSerializer):
         max_length=10000
     )
     is_read = serializers.SerializerMethodField()
-    read_by = UserShortSerializer(
-        many=True,
-        read_only=True
-    )
-    file_to_send = serializers.FileField(
+    read_by = serializers.SerializerMethodField()
+    photo_renditions = serializers.SerializerMethodField()
+    voice_duration = serializers.FloatField(read_only=True)
+    voice_waveform = serializers.SerializerMethodField()
+    file_to_send = MediaFileField(
         write_only=False,
         required=False,
         allow_empty_file=True,
         validators=[validate_file_size, validate_pdf_extension]
     )
 
-    photo_to_send = serializers.ImageField(
+    photo_to_send = MediaImageField(
         write_only=False,
         required=False,
         allow_empty_file=True,
         validators=[validate_file_size, validate_image_extension]
     )
-    voice_message = serializers.FileField(
+    voice_message = MediaFileField(
         required=False,
         allow_empty_file=True,
         validators=[validate_file_size, validate_audio_extension]
     )
+    upload = serializers.PrimaryKeyRelatedField(
+        queryset=Upload.objects.filter(is_complete=True),
+        write_only=True,
+        required=False,
+        help_text='Идентификатор завершённой загрузки по частям'
+    )
     emojis = serializers.CharField(max_length=255, required=False)
 
     sender = serializers.SlugRelatedField(
@@ -58,15 +101,52 @@ class MessageSerializer(serializers.ModelSerializer):
     )
     chat = serializers.HiddenField(default=None)
 
+    def get_read_marks(self, instance):
+        """
+        Отметки прочтения чата сообщения.
+        Загружаются один раз на чат и переиспользуются для всех сообщений.
+        """
+        read_marks = self.context.setdefault('read_marks', {})
+        if instance.chat_id not in read_marks:
+            read_marks[instance.chat_id] = instance.chat.get_read_marks()
+        return read_marks[instance.chat_id]
+
     def get_is_read(self, instance):
         user = self.context.get(
             'request').user if self.context.get('request') else None
-        if user is None:
+        if user is None or user.id == instance.sender_id:
             return False
-        return (
-            instance.read_by.filter(id=user.id).exists() and
-            user != instance.sender
-        )
+        last_read_id = self.get_read_marks(instance).get(user.id)
+        return last_read_id is not None and last_read_id >= instance.id
+
+    @extend_schema_field(serializers.DictField(child=serializers.URLField()))
+    def get_photo_renditions(self, instance):
+        request = self.context.get('request')
+        return {
+            label: get_media_url(name, request)
+            for label, name in get_renditions(
+                instance.photo_to_send.name, PHOTO_RENDITION_SIZES
+            ).items()
+        }
+
+    @extend_schema_field(
+        serializers.ListField(child=serializers.IntegerField())
+    )
+    def get_voice_waveform(self, instance):
+        if instance.voice_waveform is None:
+            return None
+        return list(bytes(instance.voice_waveform))
+
+    @extend_schema_field(UserShortSerializer(many=True))
+    def get_read_by(self, instance):
+        read_marks = self.get_read_marks(instance)
+        chat = instance.chat
+        readers = [
+            user for user in (chat.initiator, chat.receiver)
+            if user is not None and user.id != instance.sender_id and
+            (read_marks.get(user.id) or 0) >= instance.id
+        ]
+        return UserShortSerializer(readers, many=True).data
 
     class Meta:
         model = Message
@@ -76,7 +156,11 @@ class MessageSerializer(serializers.ModelSerializer):
             'text',
             'file_to_send',
             'photo_to_send',
+            'photo_renditions',
             'voice_message',
+            'voice_duration',
+            'voice_waveform',
+            'upload',
             'emojis',
             'responding_to',
             'sender_keep',
@@ -84,6 +168,9 @@ class MessageSerializer(serializers.ModelSerializer):
             'is_pinned',
             'read_by',
             'timestamp',
+            'seq',
+            'change_seq',
+            'client_id',
             'chat',
         ]
         extra_kwargs = {
@@ -96,94 +183,170 @@ class MessageSerializer(serializers.ModelSerializer):
             'is_read',
             'is_pinned',
             'read_by',
+            'photo_renditions',
+            'voice_duration',
+            'voice_waveform',
             'timestamp',
+            'seq',
+            'change_seq',
         )
 
-    def create(self, validated_data):
+    def validate_upload(self, value):
+        request = self.context.get('request')
+        if request is None or value.owner_id != request.user.id:
+            raise serializers.ValidationError('Загрузка не найдена.')
+        return value
+
 
-        file_to_send = validated_data.get('file_to_send', None)
-        photo_to_send = validated_data.get('photo_to_send', None)
-        voice_message = validated_data.get('voice_message', None)
-        emojis = validated_data.get('emojis', None)
-        text = validated_data.get('text', '')
-        # chatname = validated_data['chat']
+class ChatSyncParamsSerializer(serializers.Serializer):
+    """Параметры догрузки пропущенных изменений чата."""
 
-        validated_data['sender_keep'] = True
+    since = serializers.IntegerField(
+        min_value=0,
+        help_text='Последний полученный номер изменения (change_seq)'
+    )
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=SYNC_MAX_PAGE_SIZE,
+        default=SYNC_PAGE_SIZE,
+        help_text='Максимум сообщений в ответе'
+    )
 
-        chat = self.context.get('chat')
 
-        if not chat:
-            raise serializers.ValidationError(
-                "Chat object is missing in the context")
-        validated_data['chat'] = chat
-        if not chat.messages.exists() and (file_to_send or photo_to_send):
-            raise serializers.ValidationError(
-                "Нельзя отправить фото или файл первым сообщением"
-            )
-        if voice_message:
-            text = f'[Voice Message: {voice_message.name}]'
-        if emojis:
-            text += emojis
-
-        validated_data['sender'] = self.context['request'].user
-        message = Message.objects.create(**validated_data)
-
-        if file_to_send:
-            Attachment.objects.create(
-                name=file_to_send.name,
-                content=file_to_send.read(),
-                message=message
-            )
+class ChatSyncSerializer(serializers.Serializer):
+    """Сообщения и правки чата после указанного номера изменения."""
 
-        if photo_to_send:
-            Attachment.objects.create(
-                name=photo_to_send.name,
-                content=photo_to_send.read(),
-                message=message
-            )
+    last_seq = serializers.IntegerField(
+        help_text='Последний номер изменения чата'
+    )
+    has_more = serializers.BooleanField(
+        help_text='Есть ещё изменения, запросить с since = change_seq '
+                  'последнего сообщения'
+    )
+    messages = MessageSerializer(many=True)
 
-        message.text = text
-        message.save()
-        return message
-
-    def update(self, instance, validated_data):
-        file_to_send = validated_data.get('file_to_send', None)
-        photo_to_send = validated_data.get('photo_to_send', None)
-        voice_message = validated_data.get('voice_message', None)
-        emojis = validated_data.get('emojis', None)
-        text = validated_data.get('text', '')
-        chat = self.context.get('chat')
-        if not chat:
-            raise serializers.ValidationError(
-                "Chat object is missing in the context")
 
-        for key, value in validated_data.items():
-            setattr(instance, key, value)
+class MessageSearchParamsSerializer(serializers.Serializer):
+    """Параметры поиска по сообщениям."""
 
-        if voice_message:
-            text = f'[Voice Message: {voice_message.name}]'
-        if emojis:
-            text += emojis
+    q = serializers.CharField(
+        max_length=256,
+        help_text='Поисковый запрос'
+    )
+    lang = serializers.ChoiceField(
+        choices=SEARCH_CONFIGS,
+        required=False,
+        help_text='Языковая конфигурация поиска. По умолчанию - все'
+    )
 
-        instance.text = text
 
-        if file_to_send:
-            Attachment.objects.create(
-                name=file_to_send.name,
-                content=file_to_send.read(),
-                message=instance
-            )
+class MessageSearchSerializer(serializers.ModelSerializer):
+    """Сериализатор найденного сообщения."""
+
+    sender = serializers.SlugRelatedField(
+        slug_field='slug',
+        read_only=True
+    )
+    snippet = serializers.CharField(
+        read_only=True,
+        help_text='Фрагмент текста в HTML: текст экранирован, слова '
+                  'запроса обёрнуты в <mark>'
+    )
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Message
+        fields = (
+            'id',
+            'chat',
+            'sender',
+            'text',
+            'snippet',
+            'rank',
+            'timestamp',
+        )
+        read_only_fields = fields
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    """Сериализатор загрузки файла по частям."""
+
+    class Meta:
+        model = Upload
+        fields = (
+            'id',
+            'name',
+            'kind',
+            'size',
+            'sha256',
+            'offset',
+            'is_complete',
+            'date_created',
+        )
+        read_only_fields = (
+            'id',
+            'offset',
+            'is_complete',
+            'date_created',
+        )
 
-        if photo_to_send:
-            Attachment.objects.create(
-                name=photo_to_send.name,
-                content=photo_to_send.read(),
-                message=instance
+    def validate(self, attrs):
+        # Те же ограничения, что и при загрузке файла одним запросом
+        upload = Upload(**attrs)
+        validate_file_size(upload)
+        UPLOAD_EXTENSION_VALIDATORS[upload.kind](upload)
+        return attrs
+
+
+class UploadChunkSerializer(serializers.Serializer):
+    """Сериализатор части файла при загрузке по частям."""
+
+    offset = serializers.IntegerField(
+        min_value=0,
+        help_text='Позиция части в файле'
+    )
+    checksum = serializers.RegexField(
+        r'^[0-9a-fA-F]{64}$',
+        help_text='SHA-256 части'
+    )
+    chunk = serializers.FileField(help_text='Содержимое части')
+
+    def validate(self, attrs):
+        upload = self.context['upload']
+        if upload.is_complete:
+            raise serializers.ValidationError('Загрузка уже завершена.')
+        # Повторная отправка уже принятой части перезаписывает хвост файла
+        if attrs['offset'] > upload.offset:
+            raise serializers.ValidationError(
+                f'Загрузку нужно продолжить с позиции {upload.offset}.'
             )
+        chunk_size = attrs['chunk'].size
+        if chunk_size > UPLOAD_CHUNK_MAX_SIZE:
+            raise serializers.ValidationError('Часть слишком большая.')
+        if attrs['offset'] + chunk_size > upload.size:
+            raise serializers.ValidationError(
+                'Часть выходит за пределы заявленного размера файла.'
+            )
+        return attrs
 
-        instance.save()
 
-        return instance
+class ChatLastMessageSerializer(serializers.Serializer):
+    """Сериализатор последнего сообщения из денормализованных полей чата."""
+
+    id = serializers.IntegerField(source='last_message_id')
+    sender = serializers.SlugRelatedField(
+        source='last_message_sender',
+        slug_field='slug',
+        read_only=True
+    )
+    text = serializers.CharField(source='last_message_preview')
+    timestamp = serializers.DateTimeField(source='last_message_at')
+
+    def to_representation(self, instance):
+        # У чата без сообщений последнего сообщения нет
+        if instance.last_message_id is None:
+            return None
+        return super().to_representation(instance)
 
 
 class ChatListSerializer(serializers.ModelSerializer):
@@ -191,8 +354,10 @@ class ChatListSerializer(serializers.ModelSerializer):
 
     initiator = UserShortSerializer(many=False, read_only=True)
     receiver = UserShortSerializer(many=False, read_only=True)
-    last_message = serializers.SerializerMethodField()
-    unread = serializers.SerializerMethodField()
+    last_message = ChatLastMessageSerializer(
+        source='*', read_only=True, allow_null=True
+    )
+    unread = serializers.IntegerField(read_only=True, default=0)
 
     class Meta:
         model = PersonalChat
@@ -202,26 +367,17 @@ class ChatListSerializer(serializers.ModelSerializer):
             'receiver',
             "last_message",
             'unread',
+            'last_seq',
         )
         read_only_fields = fields
 
-    def get_last_message(self, obj):
-        message = obj.messages.first()
-        return MessageSerializer(message).data
-
-    def get_unread(self, obj):
-        return obj.messages.filter(read_by=None).count()
-
 
 class ChatSerializer(serializers.ModelSerializer):
     """Сериализатор для просмотра чата."""
 
     initiator = UserShortSerializer(many=False, read_only=True)
     receiver = UserShortSerializer(many=False, read_only=True)
-    messages = MessageSerializer(
-        many=True,
-        read_only=True
-    )
+    messages = serializers.SerializerMethodField()
     blocked_users = serializers.StringRelatedField(
         many=True
     )
@@ -234,12 +390,22 @@ class ChatSerializer(serializers.ModelSerializer):
             'receiver',
             "messages",
             "blocked_users",
+            'last_seq',
         )
         read_only_fields = (
             'id',
             'initiator',
             'receiver',
             "messages",
+            'last_seq',
+        )
+
+    def get_messages(self, obj):
+        """Последняя страница сообщений с курсорами для догрузки."""
+        paginator = MessageKeysetPagination()
+        page = paginator.get_page(obj.messages.select_related('sender'))
+        return paginator.get_paginated_data(
+            MessageSerializer(page, many=True, context=self.context).data
         )
 
 
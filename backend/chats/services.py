@@ -0,0 +1,266 @@
+"""
+Отправка и правка сообщений.
+REST view, WebSocket-консьюмер и начало личного чата создают
+сообщения только через send_messages: проверки, вставка, обновление
+чата и рассылка событий одинаковы для всех способов отправки.
+"""
+
+import json
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+from core.constants import (CLIENT_ID_MAX_LENGTH, MAX_MESSAGE_LENGTH,
+                            PHOTO_RENDITION_SIZES)
+from core.renditions import schedule_renditions
+from core.tasks import run_in_background
+
+from .events import publish_chat_events
+from .models import Attachment, Chat, Message, StoredFile, Upload
+from .serializers import MessageSerializer
+from .voice import process_voice_message
+
+FILE_FIELDS = ('file_to_send', 'photo_to_send', 'voice_message')
+
+
+def pop_files(data):
+    """Извлечь из данных сообщения файлы и загрузку по частям."""
+    files = {
+        field: data.pop(field)
+        for field in FILE_FIELDS
+        if data.get(field)
+    }
+    upload = data.pop('upload', None)
+    if upload is not None:
+        files[upload.kind] = upload
+    return files
+
+
+def store_file(upload):
+    if isinstance(upload, Upload):
+        with upload.open() as file:
+            return StoredFile.objects.store(file)
+    return StoredFile.objects.store(upload)
+
+
+def release_files(messages):
+    """Вернуть ссылки на файлы хранилища, не привязанные к сообщениям."""
+    for _, files in messages:
+        for _, stored_file in files.values():
+            StoredFile.objects.release(stored_file.pk)
+
+
+def store_files(messages):
+    """
+    Сохранить файлы сообщений в хранилище вне транзакции вставки:
+    хеширование и запись больших файлов не держат блокировку чата.
+    Строки файлов фиксируются сразу, поэтому файл на диске всегда
+    учтён, и reclaimfiles удалит его, если ссылка будет возвращена.
+    Возвращает пары (сообщение, {поле: (загрузка, файл хранилища)}).
+    """
+    stored_messages = []
+    try:
+        for message, files in messages:
+            stored = {}
+            stored_messages.append((message, stored))
+            for field, upload in files.items():
+                stored[field] = (upload, store_file(upload))
+    except Exception:
+        release_files(stored_messages)
+        raise
+    return stored_messages
+
+
+def attach_files(message, files):
+    """Привязать к сообщению файлы, сохранённые store_files."""
+    for field, (upload, stored_file) in files.items():
+        attachment = Attachment.objects.create_from_stored(
+            message, upload.name, stored_file
+        )
+        if isinstance(upload, Upload):
+            upload.delete()
+        setattr(message, field, attachment.file.name)
+        if field == 'photo_to_send':
+            schedule_renditions(
+                attachment.file.name, PHOTO_RENDITION_SIZES
+            )
+        elif field == 'voice_message':
+            message.voice_duration = None
+            message.voice_waveform = None
+            run_in_background(
+                process_voice_message, message.pk, attachment.file.name
+            )
+
+
+def get_text(data, files):
+    text = data.get('text') or ''
+    voice_message = files.get('voice_message')
+    if voice_message:
+        text = f'[Voice Message: {voice_message.name}]'
+    if data.get('emojis'):
+        text += data['emojis']
+    return text
+
+
+def check_can_send(chat, sender):
+    if chat.blocked_users.filter(pk=sender.pk).exists():
+        raise PermissionDenied(
+            'Вы не можете отправлять сообщения,'
+            ' так как вы заблокированы в этом чате.'
+        )
+
+
+def build_messages(chat, sender, items):
+    """Проверить данные и собрать несохранённые сообщения с их файлами."""
+    messages = []
+    for data in items:
+        data = dict(data)
+        files = pop_files(data)
+        text = get_text(data, files)
+        if not text and not files:
+            raise ValidationError('Пустое сообщение.')
+        if len(text) > MAX_MESSAGE_LENGTH:
+            raise ValidationError('Слишком длинное сообщение.')
+        client_id = data.get('client_id') or None
+        if client_id is not None and (
+            not isinstance(client_id, str)
+            or len(client_id) > CLIENT_ID_MAX_LENGTH
+        ):
+            raise ValidationError('Некорректный ключ отправки.')
+        messages.append((Message(
+            chat=chat,
+            sender=sender,
+            text=text,
+            emojis=data.get('emojis') or '',
+            responding_to=data.get('responding_to'),
+            client_id=client_id,
+            sender_keep=True,
+        ), files))
+    # Запрос нужен только когда первым сообщением отправляют файл
+    first_files = messages[0][1]
+    if (
+        ('file_to_send' in first_files or 'photo_to_send' in first_files)
+        and not chat.messages.exists()
+    ):
+        raise ValidationError(
+            'Нельзя отправить фото или файл первым сообщением'
+        )
+    return messages
+
+
+def get_sent_messages(chat, sender, client_ids):
+    """Уже сохранённые сообщения отправителя по ключам отправки."""
+    if not client_ids:
+        return {}
+    return {
+        message.client_id: message
+        for message in Message.objects.filter(
+            chat_id=chat.pk, sender=sender, client_id__in=client_ids
+        ).select_related('sender')
+    }
+
+
+def insert_messages(chat, sender, messages, context):
+    with transaction.atomic():
+        sent = get_sent_messages(chat, sender, [
+            message.client_id for message, _ in messages
+            if message.client_id is not None
+        ])
+        results = []
+        new_messages = []
+        for message, files in messages:
+            if message.client_id in sent:
+                # Повтор отправки: исходное сообщение без вставки и рассылки
+                results.append((sent[message.client_id], False))
+                release_files([(message, files)])
+                continue
+            results.append((message, True))
+            new_messages.append((message, files))
+            if message.client_id is not None:
+                sent[message.client_id] = message
+        if not new_messages:
+            return results
+
+        now = timezone.now()
+        last_seq = Chat.allocate_seq(chat.pk, len(new_messages))
+        first_seq = last_seq - len(new_messages) + 1
+        for seq, (message, _) in enumerate(new_messages, first_seq):
+            message.seq = message.change_seq = seq
+            message.date_edited = now
+        # save() сообщения не вызывается: номера уже выделены,
+        # данные чата обновляются один раз на всю партию
+        Message.objects.bulk_create([message for message, _ in new_messages])
+        for message, files in new_messages:
+            if files:
+                attach_files(message, files)
+                # Файлы дописываются к новому сообщению, это не правка
+                message.save(update_fields=list(files))
+        new_messages = [message for message, _ in new_messages]
+        new_messages[-1].update_chat_state(count=len(new_messages))
+        # Подключения получают уже сериализованные сообщения
+        publish_chat_events(chat, [
+            {'type': 'chat_message', 'payload': json.dumps(data)}
+            for data in MessageSerializer(
+                new_messages, many=True, context=context or {}
+            ).data
+        ])
+    return results
+
+
+def send_messages(chat, sender, items, context=None):
+    """
+    Отправить сообщения в чат от имени sender.
+    items - данные сообщений в формате validated_data MessageSerializer.
+    Возвращает пары (сообщение, создано) в порядке items: сообщение
+    с уже использованным client_id не сохраняется и не рассылается
+    повторно, вместо него возвращается исходное.
+    Число запросов не зависит от количества сообщений: номера
+    выделяются одним блоком, сообщения и события outbox вставляются
+    через bulk_create. Отдельные запросы нужны только для файлов,
+    файлы сохраняются до транзакции вставки.
+    """
+    if not items:
+        return []
+    check_can_send(chat, sender)
+    messages = store_files(build_messages(chat, sender, items))
+    try:
+        try:
+            return insert_messages(chat, sender, messages, context)
+        except IntegrityError:
+            if all(message.client_id is None for message, _ in messages):
+                raise
+            # Параллельный повтор с тем же ключом сохранил сообщение
+            # раньше, теперь оно найдётся по ключу
+            return insert_messages(chat, sender, messages, context)
+    except Exception:
+        # Вставка откачена, ссылки на сохранённые файлы не нужны
+        release_files(messages)
+        raise
+
+
+def send_message(chat, sender, data, context=None):
+    """Отправить одно сообщение, вернуть (сообщение, создано)."""
+    return send_messages(chat, sender, [data], context)[0]
+
+
+def edit_message(message, data):
+    """Изменить текст и файлы сообщения."""
+    data = dict(data)
+    data.pop('chat', None)
+    # Ключ отправки задаётся один раз при создании
+    data.pop('client_id', None)
+    files = pop_files(data)
+    for key, value in data.items():
+        setattr(message, key, value)
+    message.text = get_text(data, files)
+    stored_messages = store_files([(message, files)])
+    try:
+        with transaction.atomic():
+            attach_files(message, stored_messages[0][1])
+            message.save()
+    except Exception:
+        release_files(stored_messages)
+        raise
+    return message
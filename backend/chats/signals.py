@@ -0,0 +1,34 @@
+"""Сигналы приложения chats."""
+
+import os
+
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Attachment, StoredFile, Upload
+
+
+@receiver(post_delete, sender=Attachment)
+def release_stored_file(sender, instance, **kwargs):
+    """Уменьшить счётчик ссылок на файл удалённого вложения."""
+    if instance.stored_file_id is not None:
+        StoredFile.objects.release(instance.stored_file_id)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@receiver(post_delete, sender=Upload)
+def remove_upload_file(sender, instance, **kwargs):
+    """
+    Удалить собранный на диске файл загрузки по частям.
+    Файл удаляется после фиксации транзакции: при откате
+    строка загрузки восстанавливается и файл ещё нужен.
+    """
+    path = instance.path
+    transaction.on_commit(lambda: remove_file(path))
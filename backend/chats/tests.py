@@ -0,0 +1,562 @@
+"""Тесты приложения chats."""
+
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from rest_framework.test import APIClient
+
+from chats import routing
+from chats.events import dispatch_pending, publish_chat_events
+from chats.models import (Message, OutboxEvent, PersonalChat, Upload,
+                          get_escaped_text)
+from chats.services import edit_message, send_message, send_messages
+from core.constants import OUTBOX_MAX_ATTEMPTS, WS_CLOSE_SLOW_CONSUMER
+
+User = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+
+
+def create_chat():
+    """Отправитель, получатель и личный чат между ними."""
+    sender = User.objects.create_user(
+        'sender', 'sender@example.com', 'password'
+    )
+    receiver = User.objects.create_user(
+        'receiver', 'receiver@example.com', 'password'
+    )
+    chat = PersonalChat.objects.create(initiator=sender, receiver=receiver)
+    return sender, receiver, chat
+
+
+def get_communicator(user, path='/ws/user/'):
+    """Подключение пользователя без рукопожатия с токеном."""
+    communicator = WebsocketCommunicator(
+        URLRouter(routing.websocket_urlpatterns), path
+    )
+    communicator.scope['user'] = user
+    return communicator
+
+
+class SendMessagesQueryCountTest(TestCase):
+    """Число запросов отправки не зависит от количества сообщений."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.receiver, cls.chat = create_chat()
+
+    def send(self, count):
+        return send_messages(self.chat, self.sender, [
+            {'text': f'Сообщение {i}'} for i in range(count)
+        ])
+
+    def test_query_count_is_constant(self):
+        self.send(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.send(1)
+        with self.assertNumQueries(len(queries)):
+            self.send(50)
+        seqs = Message.objects.order_by('seq').values_list('seq', flat=True)
+        self.assertEqual(list(seqs), list(range(1, 53)))
+
+    def test_empty_batch(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.send(0), [])
+
+
+class MessageHistoryTest(TestCase):
+    """История сообщений с пагинацией по ключу (timestamp, id)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.receiver, cls.chat = create_chat()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.receiver)
+
+    def send(self, count):
+        return [
+            message.pk for message, _ in send_messages(
+                self.chat, self.sender, [
+                    {'text': f'Сообщение {i}'} for i in range(count)
+                ]
+            )
+        ]
+
+    def get_page(self, **params):
+        response = self.client.get(
+            reverse('chats-messages', args=[self.chat.pk]), params
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_with_equal_timestamps(self):
+        ids = self.send(5)
+        # Сообщения одной секунды различаются только по id
+        Message.objects.update(timestamp=timezone.now())
+        pages = []
+        page = self.get_page(limit=2)
+        while True:
+            pages.append([message['id'] for message in page['results']])
+            if page['before'] is None:
+                break
+            page = self.get_page(limit=2, before=page['before'])
+        self.assertEqual(pages, [ids[:2:-1], ids[2:0:-1], ids[:1]])
+
+    def test_after_returns_newer_messages(self):
+        self.send(3)
+        after = self.get_page()['after']
+        ids = self.send(2)
+        page = self.get_page(after=after)
+        self.assertEqual(
+            [message['id'] for message in page['results']], ids[::-1]
+        )
+        self.assertEqual(self.get_page(after=page['after'])['results'], [])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse('chats-messages', args=[self.chat.pk]),
+            {'before': 'not-a-cursor'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ClientIdReplayTest(TestCase):
+    """Повтор отправки с тем же client_id не создаёт сообщение."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.receiver, cls.chat = create_chat()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.sender)
+
+    def post(self, text, client_id):
+        return self.client.post(
+            reverse('chats-send-message', args=[self.chat.pk]),
+            {'text': text, 'client_id': client_id},
+            format='json'
+        )
+
+    def test_replay_returns_original(self):
+        self.assertEqual(self.post('Привет', 'key-1').status_code, 201)
+        self.assertEqual(self.post('Повтор', 'key-1').status_code, 200)
+        self.assertEqual(self.post('Другое', 'key-2').status_code, 201)
+        self.assertEqual(
+            list(Message.objects.order_by('seq').values_list(
+                'text', flat=True
+            )),
+            ['Привет', 'Другое']
+        )
+        # Повтор не рассылается
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+
+    def test_replay_in_one_batch(self):
+        [(first, created), (second, replayed)] = send_messages(
+            self.chat, self.sender, [
+                {'text': 'Привет', 'client_id': 'key'},
+                {'text': 'Привет', 'client_id': 'key'},
+            ]
+        )
+        self.assertEqual((created, replayed), (True, False))
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(self.chat.messages.count(), 1)
+
+    def test_key_is_scoped_to_sender(self):
+        send_message(self.chat, self.sender, {
+            'text': 'Привет', 'client_id': 'key'
+        })
+        _, created = send_message(self.chat, self.receiver, {
+            'text': 'Привет', 'client_id': 'key'
+        })
+        self.assertTrue(created)
+        self.assertEqual(self.chat.messages.count(), 2)
+
+
+class ChatListTest(TestCase):
+    """Список чатов из денормализованных полей чата."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.receiver, cls.chat = create_chat()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.receiver)
+
+    def get_chat(self):
+        response = self.client.get(reverse('chats-list'))
+        self.assertEqual(response.status_code, 200)
+        [chat] = response.data['results']
+        return chat
+
+    def test_chat_without_messages_has_no_last_message(self):
+        self.assertIsNone(self.get_chat()['last_message'])
+
+    def test_last_message_and_unread_count(self):
+        send_messages(self.chat, self.sender, [
+            {'text': 'Первое'}, {'text': 'Второе'}
+        ])
+        chat = self.get_chat()
+        self.assertEqual(chat['last_message']['text'], 'Второе')
+        self.assertEqual(chat['last_message']['sender'], self.sender.slug)
+        self.assertEqual(chat['unread'], 2)
+
+
+class ChatSyncTest(TestCase):
+    """Догрузка изменений чата после номера изменения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.receiver, cls.chat = create_chat()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.receiver)
+
+    def send(self, count):
+        return send_messages(self.chat, self.sender, [
+            {'text': f'Сообщение {i}'} for i in range(count)
+        ])
+
+    def sync(self, since, **params):
+        response = self.client.get(
+            reverse('chats-sync', args=[self.chat.pk]),
+            {'since': since, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_query_count_does_not_depend_on_message_count(self):
+        self.send(1)
+        self.sync(0)
+        with CaptureQueriesContext(connection) as queries:
+            self.sync(0)
+        self.send(20)
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(len(self.sync(0)['messages']), 21)
+
+    def test_changes_after_since(self):
+        self.send(3)
+        data = self.sync(1, limit=1)
+        self.assertEqual(data['last_seq'], 3)
+        self.assertTrue(data['has_more'])
+        self.assertEqual(
+            [message['seq'] for message in data['messages']], [2]
+        )
+
+    def test_edit_is_a_new_change(self):
+        [(message, _)] = self.send(1)
+        edit_message(message, {'text': 'Исправлено'})
+        data = self.sync(1)
+        self.assertEqual(data['last_seq'], 2)
+        self.assertFalse(data['has_more'])
+        [changed] = data['messages']
+        self.assertEqual(changed['seq'], 1)
+        self.assertEqual(changed['change_seq'], 2)
+        self.assertEqual(changed['text'], 'Исправлено')
+
+
+class OutboxDispatchTest(TestCase):
+    """Рассылка событий outbox по порядку и повтор неотправленных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.receiver, cls.chat = create_chat()
+
+    def setUp(self):
+        self.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        patcher = mock.patch(
+            'chats.events.get_channel_layer', return_value=self.channel_layer
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def publish(self, *types):
+        publish_chat_events(self.chat, [{'type': type_} for type_ in types])
+
+    def get_sent_types(self):
+        return [
+            call.args[1]['type']
+            for call in self.channel_layer.group_send.call_args_list
+        ]
+
+    def fail_on(self, failed_type):
+        def group_send(group, event):
+            if event['type'] == failed_type:
+                raise ConnectionError
+
+        self.channel_layer.group_send.side_effect = group_send
+
+    def test_events_are_sent_in_order_and_deleted(self):
+        self.publish('first', 'second')
+        self.assertEqual(dispatch_pending(), 2)
+        # Каждое событие уходит в группы обоих участников
+        self.assertEqual(
+            self.get_sent_types(), ['first', 'first', 'second', 'second']
+        )
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_events_after_failure_are_postponed(self):
+        self.publish('first', 'failed', 'third')
+        self.fail_on('failed')
+        with self.assertLogs('chats.events', 'ERROR'):
+            self.assertEqual(dispatch_pending(), 1)
+        postponed = OutboxEvent.objects.all()
+        self.assertEqual(
+            [event.event['type'] for event in postponed], ['failed', 'third']
+        )
+        for event in postponed:
+            self.assertEqual(event.attempts, 1)
+            self.assertGreater(event.available_at, timezone.now())
+        # Отложенные события не берутся до available_at
+        self.assertEqual(dispatch_pending(), 0)
+
+    def test_event_is_dropped_after_max_attempts(self):
+        self.publish('failed')
+        OutboxEvent.objects.update(attempts=OUTBOX_MAX_ATTEMPTS - 1)
+        self.fail_on('failed')
+        with self.assertLogs('chats.events', 'ERROR'):
+            self.assertEqual(dispatch_pending(), 0)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+
+class MessageSearchTest(TestCase):
+    """Сниппеты поиска не пропускают HTML из текста сообщения."""
+
+    text = '<img src=x onerror=alert(1)> привет & пока'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.receiver, cls.chat = create_chat()
+        send_messages(cls.chat, cls.sender, [{'text': cls.text}])
+
+    def test_escaped_text(self):
+        self.assertEqual(
+            Message.objects.values_list(
+                get_escaped_text(), flat=True
+            ).get(),
+            '&lt;img src=x onerror=alert(1)&gt; привет &amp; пока'
+        )
+
+    @skipUnless(
+        connection.vendor == 'postgresql', 'Full-text search needs PostgreSQL'
+    )
+    def test_snippet_is_escaped(self):
+        client = APIClient()
+        client.force_authenticate(self.receiver)
+        response = client.get(reverse('chats-search'), {'q': 'привет'})
+        self.assertEqual(response.status_code, 200)
+        [result] = response.data['results']
+        self.assertEqual(result['text'], self.text)
+        self.assertIn('&lt;img', result['snippet'])
+        self.assertIn('<mark>привет</mark>', result['snippet'])
+        self.assertNotIn('<img', result['snippet'])
+
+
+class UploadTest(TestCase):
+    """Загрузка файла по частям с продолжением и проверкой хеша."""
+
+    content = b'%PDF-1.4 ' + bytes(range(256)) * 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            'user', 'user@example.com', 'password'
+        )
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('uploads-list'), {
+            'name': 'document.pdf',
+            'kind': 'file_to_send',
+            'size': len(self.content),
+            'sha256': hashlib.sha256(self.content).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.upload_id = response.data['id']
+
+    def send_chunk(self, offset, chunk, checksum=None):
+        return self.client.post(
+            reverse('uploads-chunks', args=[self.upload_id]),
+            {
+                'offset': offset,
+                'checksum': checksum or hashlib.sha256(chunk).hexdigest(),
+                'chunk': SimpleUploadedFile('chunk', chunk),
+            }
+        )
+
+    def finalize(self):
+        return self.client.post(
+            reverse('uploads-finalize', args=[self.upload_id])
+        )
+
+    def test_resume_and_finalize(self):
+        response = self.send_chunk(0, self.content[:500])
+        self.assertEqual(response.data['offset'], 500)
+        # Клиент узнаёт позицию продолжения после обрыва
+        response = self.client.get(
+            reverse('uploads-detail', args=[self.upload_id])
+        )
+        self.assertEqual(response.data['offset'], 500)
+        self.send_chunk(500, self.content[500:])
+        response = self.finalize()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_complete'])
+        with Upload.objects.get(pk=self.upload_id).open() as file:
+            self.assertEqual(file.read(), self.content)
+
+    def test_chunk_with_wrong_checksum_is_discarded(self):
+        self.send_chunk(0, self.content[:500])
+        response = self.send_chunk(500, self.content[500:], '0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['offset'], 500)
+        self.assertEqual(
+            os.path.getsize(Upload.objects.get(pk=self.upload_id).path), 500
+        )
+
+    def test_chunk_after_gap_is_rejected(self):
+        response = self.send_chunk(100, self.content[100:200])
+        self.assertEqual(response.status_code, 400)
+
+    def test_incomplete_upload_is_not_finalized(self):
+        self.send_chunk(0, self.content[:500])
+        response = self.finalize()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['offset'], 500)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatFanOutQueryCountTest(TransactionTestCase):
+    """
+    Сообщение из WebSocket сохраняется и сериализуется один раз,
+    подключения получателя только пересылают готовый кадр.
+    Рассылка outbox вызывается явно, а не фоновым потоком,
+    чтобы все запросы шли через соединение теста.
+    """
+
+    def setUp(self):
+        self.sender, self.receiver, self.chat = create_chat()
+        patcher = mock.patch('chats.events.request_dispatch')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def dispatch(self):
+        # Кадр обрабатывается консьюмером отправителя асинхронно
+        while not await database_sync_to_async(dispatch_pending)():
+            await asyncio.sleep(0.01)
+
+    async def send_to_room(self, size, text):
+        """Отправить сообщение в комнату из size подключений получателя."""
+        sender = get_communicator(self.sender)
+        receivers = [get_communicator(self.receiver) for _ in range(size)]
+        for communicator in (sender, *receivers):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            ping = await communicator.receive_json_from()
+            self.assertEqual(ping['type'], 'ping')
+
+        # Запросы консьюмеров выполняются в потоке теста
+        queries = CaptureQueriesContext(connection)
+        await database_sync_to_async(queries.__enter__)()
+        await sender.send_json_to({'chat_id': self.chat.pk, 'message': text})
+        await self.dispatch()
+        frames = [
+            await communicator.receive_json_from()
+            for communicator in receivers
+        ]
+        await database_sync_to_async(queries.__exit__)(None, None, None)
+
+        for communicator in (sender, *receivers):
+            await communicator.disconnect()
+        self.assertEqual(
+            [frame['message']['text'] for frame in frames], [text] * size
+        )
+        return await database_sync_to_async(len)(queries)
+
+    def test_query_count_does_not_depend_on_room_size(self):
+        single = async_to_sync(self.send_to_room)(1, 'Первое')
+        self.assertEqual(
+            async_to_sync(self.send_to_room)(50, 'Второе'), single
+        )
+        self.assertEqual(Message.objects.count(), 2)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class PingTest(TransactionTestCase):
+    """Кадры ping подключения ws/user/ и разбор входящих кадров."""
+
+    def setUp(self):
+        self.sender, self.receiver, self.chat = create_chat()
+
+    async def connect(self, path='/ws/user/'):
+        communicator = get_communicator(self.sender, path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    @mock.patch('core.consumers.WS_PONG_TIMEOUT', 0.2)
+    @mock.patch('core.consumers.WS_PING_INTERVAL', 0.05)
+    async def test_silent_client_is_evicted(self):
+        communicator = await self.connect()
+        ping = await communicator.receive_json_from()
+        self.assertEqual(ping['type'], 'ping')
+        self.assertEqual(
+            await communicator.receive_output(timeout=1),
+            {'type': 'websocket.close', 'code': WS_CLOSE_SLOW_CONSUMER}
+        )
+
+    @mock.patch('core.consumers.WS_PONG_TIMEOUT', 0.2)
+    @mock.patch('core.consumers.WS_PING_INTERVAL', 0.05)
+    async def test_answering_client_stays_connected(self):
+        communicator = await self.connect()
+        # Ответы идут дольше WS_PONG_TIMEOUT
+        for ping_id in range(1, 8):
+            ping = await communicator.receive_json_from(timeout=1)
+            self.assertEqual(ping, {'type': 'ping', 'id': ping_id})
+            await communicator.send_json_to({'type': 'pong', 'id': ping_id})
+        await communicator.disconnect()
+
+    @mock.patch('core.consumers.WS_PING_INTERVAL', 0.05)
+    async def test_legacy_chat_connection_gets_no_pings(self):
+        communicator = await self.connect(f'/ws/chats/{self.chat.pk}/')
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.disconnect()
+
+    async def test_malformed_frames_are_rejected(self):
+        communicator = await self.connect()
+        await communicator.receive_json_from()
+        for frame in ({'bytes_data': b'{}'}, {'text_data': '{'},
+                      {'text_data': '[]'}):
+            await communicator.send_to(**frame)
+            self.assertEqual(await communicator.receive_json_from(), {
+                'type': 'error',
+                'detail': 'Некорректный кадр.',
+            })
+        await communicator.disconnect()
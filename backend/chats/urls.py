@@ -4,12 +4,17 @@ from django.urls import include, path
 
 from rest_framework import routers
 
-from chats.views import ChatViewSet
+from chats.views import (CacheStatsView, ChatViewSet, MediaView, UploadViewSet,
+                         WebSocketStatsView)
 
 router = routers.DefaultRouter()
 
 router.register('chats', ChatViewSet, basename='chats')
+router.register('uploads', UploadViewSet, basename='uploads')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('media/<path:path>', MediaView.as_view(), name='media'),
+    path('ws-stats/', WebSocketStatsView.as_view(), name='ws-stats'),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
 ]
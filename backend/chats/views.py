@@ -1,24 +1,57 @@
 """View-функции приложения chats."""
 
+import mimetypes
+import os
+import posixpath
+from functools import reduce
+from operator import or_
+from urllib.parse import quote
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Q
-from django.http import HttpResponseForbidden
+from django.contrib.postgres.search import (SearchHeadline, SearchQuery,
+                                            SearchRank)
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, FloatField, OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Coalesce
+from django.http import (FileResponse, HttpResponse, HttpResponseForbidden,
+                         HttpResponseNotModified, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from django_filters.rest_framework import DjangoFilterBackend
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, extend_schema_view
 from rest_framework import filters, mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-
-from chats.models import Chat, GroupChat, Message, PersonalChat
+from rest_framework.views import APIView
+
+from chats.events import publish_chat_event
+from chats.files import get_file_etag, iter_file_range, parse_range
+from chats.filters import NullsLastOrderingFilter
+from chats.models import (Attachment, Chat, ChatReadState, GroupChat, Message,
+                          PersonalChat, Upload, get_escaped_text,
+                          get_search_vector)
 from chats.serializers import (ChatListSerializer, ChatSerializer,
-                               ChatStartSerializer, GroupChatCreateSerializer,
-                               GroupChatSerializer, MessageSerializer)
-from core.pagination import LimitPagination
+                               ChatStartSerializer, ChatSyncParamsSerializer,
+                               ChatSyncSerializer, GroupChatCreateSerializer,
+                               GroupChatSerializer,
+                               MessageSearchParamsSerializer,
+                               MessageSearchSerializer, MessageSerializer,
+                               UploadChunkSerializer, UploadSerializer)
+from chats.services import edit_message, send_message
+from core.constants import (SEARCH_CONFIGS, SEARCH_HIGHLIGHT_START,
+                            SEARCH_HIGHLIGHT_STOP)
+from core.consumers import get_stats
+from core.pagination import (LimitPagination, MessageKeysetPagination,
+                             MessageSearchPagination)
+from core.renditions import get_original_name
 
 # from core.permissions import ActiveChatOrReceiverOnly
 
@@ -43,7 +76,36 @@ User = get_user_model()
     ),
     send_message=extend_schema(
         summary='Отправить сообщение',
-        description='Отправить сообщение в чат',
+        description=(
+            'Отправить сообщение в чат. Повторная отправка с тем же '
+            '`client_id` не создаёт сообщение и отвечает кодом 200'
+        ),
+    ),
+    search=extend_schema(
+        summary='Найти сообщения',
+        description=(
+            'Полнотекстовый поиск по сообщениям своих чатов. '
+            'Результаты отсортированы по релевантности, '
+            'найденные слова в `snippet` выделены тегом <mark>'
+        ),
+        parameters=[MessageSearchParamsSerializer],
+    ),
+    messages=extend_schema(
+        summary='Просмотреть историю сообщений',
+        description=(
+            'Просмотреть сообщения чата постранично. Курсор `before` '
+            'загружает более старые сообщения, `after` - новые'
+        ),
+    ),
+    sync=extend_schema(
+        summary='Догрузить пропущенные изменения чата',
+        description=(
+            'Сообщения, отправленные или изменённые после номера `since`, '
+            'в порядке `change_seq`. Номера изменений чата идут подряд, '
+            'пропуск номера в событиях WebSocket означает, что нужно '
+            'запросить изменения с последнего полученного номера'
+        ),
+        parameters=[ChatSyncParamsSerializer],
     ),
 )
 class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
@@ -55,21 +117,33 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
     ]
     pagination_class = LimitPagination
     filter_backends = [
-        filters.SearchFilter, filters.OrderingFilter, DjangoFilterBackend
+        filters.SearchFilter, NullsLastOrderingFilter, DjangoFilterBackend
     ]
     search_fields = (
         'initiator__username', 'initiator__first_name',
         'receiver__username', 'receiver__first_name',
     )
-    ordering = ('-date_created',)
+    ordering_fields = ('last_message_at', 'date_created')
+    ordering = ('-last_message_at', '-date_created')
 
     def get_queryset(self):
-        if self.request.user.is_authenticated:
-            return PersonalChat.objects.filter(
-                Q(initiator=self.request.user) |
-                Q(receiver=self.request.user)
-            )
-        return Chat.objects.none()
+        if not self.request.user.is_authenticated:
+            return Chat.objects.none()
+        queryset = PersonalChat.objects.filter(
+            Q(participant_low=self.request.user) |
+            Q(participant_high=self.request.user)
+        )
+        if self.action != 'list':
+            return queryset
+        # Последнее сообщение и счётчик непрочитанных хранятся
+        # денормализованно, список отдаётся одним запросом
+        unread = ChatReadState.objects.filter(
+            chat=OuterRef('pk'),
+            user=self.request.user
+        ).values('unread_count')[:1]
+        return queryset.select_related(
+            'initiator', 'receiver', 'last_message_sender'
+        ).annotate(unread=Coalesce(Subquery(unread), 0))
 
     def get_permissions(self):
         # if self.action == 'send_message':
@@ -80,8 +154,12 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
         match self.action:
             case 'list':
                 return ChatListSerializer
-            case 'send_message':
+            case 'send_message' | 'messages':
                 return MessageSerializer
+            case 'search':
+                return MessageSearchSerializer
+            case 'sync':
+                return ChatSyncSerializer
             case 'start_personal_chat':
                 return ChatStartSerializer
             case 'start_group_chat':
@@ -96,6 +174,84 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
         """Просмотреть чат"""
         return super().retrieve(request, *args, **kwargs)
 
+    @action(
+        methods=['get'],
+        detail=True,
+        permission_classes=(IsAuthenticated,),
+        serializer_class=MessageSerializer,
+        pagination_class=MessageKeysetPagination,
+        filter_backends=(),
+    )
+    def messages(self, request, pk=None):
+        """Просмотреть историю сообщений чата"""
+        chat = self.get_object()
+        queryset = chat.messages.select_related('sender')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['get'],
+        detail=True,
+        permission_classes=(IsAuthenticated,),
+        serializer_class=ChatSyncSerializer,
+        pagination_class=None,
+        filter_backends=(),
+    )
+    def sync(self, request, pk=None):
+        """Догрузить сообщения и правки после номера изменения"""
+        chat = self.get_object()
+        params = ChatSyncParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        serializer = self.get_serializer(
+            chat.get_changes(**params.validated_data)
+        )
+        return Response(serializer.data)
+
+    @action(
+        methods=['get'],
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        serializer_class=MessageSearchSerializer,
+        pagination_class=MessageSearchPagination,
+        filter_backends=(),
+    )
+    def search(self, request):
+        """Найти сообщения в своих чатах"""
+        params = MessageSearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        lang = params.validated_data.get('lang')
+        query = reduce(or_, (
+            SearchQuery(
+                params.validated_data['q'],
+                config=config,
+                search_type='websearch'
+            )
+            for config in ((lang,) if lang else SEARCH_CONFIGS)
+        ))
+        # Вектор совпадает с выражением GIN-индекса message_text_search_idx
+        queryset = Message.objects.filter(
+            chat__in=self.get_queryset().values('pk')
+        ).alias(
+            search=get_search_vector()
+        ).filter(
+            search=query
+        ).annotate(
+            rank=Cast(SearchRank(F('search'), query), FloatField()),
+            snippet=SearchHeadline(
+                get_escaped_text(),
+                query,
+                config=lang or 'simple',
+                start_sel=SEARCH_HIGHLIGHT_START,
+                stop_sel=SEARCH_HIGHLIGHT_STOP,
+            ),
+        ).select_related('sender').only(
+            'chat_id', 'sender__slug', 'text', 'timestamp'
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(
         methods=['post'],
         detail=False,
@@ -112,26 +268,23 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
         serializer.is_valid(raise_exception=True)
         user_slug = serializer.data["receiver"]
         user = get_object_or_404(User, slug=user_slug)
-        chat = PersonalChat.objects.filter(
-            Q(initiator=current_user, receiver=user) |
-            Q(initiator=user, receiver=current_user)
-        )
 
-        if chat.exists():
-            return Response(
-                {'message': f'Чат с пользователем {user} уже создан.'},
-                status=status.HTTP_400_BAD_REQUEST
+        with transaction.atomic():
+            # Уникальный индекс по паре участников исключает дубли
+            # при одновременных запросах
+            chat, created = PersonalChat.objects.get_or_create(
+                **PersonalChat.get_pair_lookup(current_user, user),
+                defaults={'initiator': current_user, 'receiver': user}
+            )
+            if not created:
+                return Response(
+                    {'message': f'Чат с пользователем {user} уже создан.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            send_message(
+                chat, current_user, {'text': serializer.data['message']},
+                context=self.get_serializer_context()
             )
-        chat = PersonalChat.objects.create(
-            initiator=current_user,
-            receiver=user
-        )
-        message_text = serializer.data['message']
-        Message.objects.create(
-            sender=current_user,
-            text=message_text,
-            chat=chat
-        )
         return Response(
             ChatSerializer(chat).data,
             status=status.HTTP_201_CREATED
@@ -178,38 +331,18 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
         """Отправить сообщение в чат"""
         chat = self.get_object()
 
-#         serializer = self.get_serializer(
-#             data={**request.data},
-#             # Передаем chat через контекст
-#             context={'request': request, 'chat': chat}
-#         )
-
-        if chat.is_user_blocked(request.user):
-            return Response(
-                {
-                    "detail": "Вы не можете отправлять сообщения,"
-                    " так как вы заблокированы в этом чате."
-                },
-                status=status.HTTP_403_FORBIDDEN
-            )
         serializer = self.get_serializer(data={
             **request.data
         })
-
         serializer.is_valid(raise_exception=True)
-        serializer.save(chat=chat, sender=request.user)
-
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"chat_{chat.pk}",
-            {
-                "type": "chat_message",
-                "message": serializer['text']
-            }
+        _, created = send_message(
+            chat, request.user, serializer.validated_data,
+            context=self.get_serializer_context()
         )
+        # Повтор с тем же client_id ничего не создаёт
         return Response(
             ChatSerializer(chat).data,
-            status=status.HTTP_201_CREATED
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
         )
 
     @action(detail=True, methods=['put'])
@@ -234,7 +367,7 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
         )
 
         if serializer.is_valid():
-            serializer.save()
+            edit_message(message, serializer.validated_data)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -247,8 +380,7 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
         user = self.request.user
 
         if chat.initiator == user or chat.receiver == user:
-            for message in chat.messages.exclude(read_by=user):
-                message.read_by.add(user)
+            chat.mark_read(user)
             return Response({"detail": "Chat read status updated."})
 
         return HttpResponseForbidden(
@@ -281,17 +413,14 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
-                chat.blocked_users.add(user_to_block)
-                # Отправить обновление через веб-сокеты
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    f"chat_{chat.pk}",
-                    {
-                        "type": "block_user",
+                with transaction.atomic():
+                    chat.blocked_users.add(user_to_block)
+                    # Отправить обновление через веб-сокеты
+                    publish_chat_event(chat, {
+                        "type": "block_user_notification",
                         "user_slug": user_slug,
                         "blocked": True
-                    }
-                )
+                    })
 
                 return Response(
                     {"detail": "Пользователь заблокирован в этом чате."},
@@ -330,17 +459,13 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
             ):
                 # if chat.members.filter(id=user_to_unblock.id).exists():
                 if user_to_unblock in chat.blocked_users.all():
-                    chat.blocked_users.remove(user_to_unblock)
-
-                    channel_layer = get_channel_layer()
-                    async_to_sync(channel_layer.group_send)(
-                        f"chat_{chat.pk}",
-                        {
-                            "type": "block_user",
+                    with transaction.atomic():
+                        chat.blocked_users.remove(user_to_unblock)
+                        publish_chat_event(chat, {
+                            "type": "block_user_notification",
                             "user_slug": user_slug,
                             "blocked": False
-                        }
-                    )
+                        })
                     return Response(
                         {"detail": "Пользователь разблокирован в этом чате"},
                         status=status.HTTP_200_OK
@@ -361,3 +486,256 @@ class ChatViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
              "разблокировать участников в этом чате"},
             status=status.HTTP_403_FORBIDDEN
         )
+
+
+@extend_schema(tags=['uploads'])
+@extend_schema_view(
+    create=extend_schema(
+        summary='Начать загрузку файла по частям',
+        description=(
+            'Создать загрузку с названием, типом и полным размером файла. '
+            'Необязательный `sha256` проверяется при завершении'
+        ),
+    ),
+    retrieve=extend_schema(
+        summary='Просмотреть загрузку',
+        description='Узнать позицию, с которой нужно продолжить загрузку',
+    ),
+    destroy=extend_schema(
+        summary='Отменить загрузку',
+        description='Удалить загрузку и собранную часть файла',
+    ),
+    chunks=extend_schema(
+        summary='Загрузить часть файла',
+        description=(
+            'Дописать часть файла с позиции `offset`. '
+            'Часть с неверной контрольной суммой отбрасывается'
+        ),
+        request=UploadChunkSerializer,
+        responses=UploadSerializer,
+    ),
+    finalize=extend_schema(
+        summary='Завершить загрузку',
+        description=(
+            'Проверить размер и хеш файла. Идентификатор завершённой '
+            'загрузки передаётся в поле `upload` при отправке сообщения'
+        ),
+        request=None,
+        responses=UploadSerializer,
+    ),
+)
+class UploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                    mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    serializer_class = UploadSerializer
+    permission_classes = [
+        IsAuthenticated,
+    ]
+
+    def get_queryset(self):
+        if not self.request.user.is_authenticated:
+            return Upload.objects.none()
+        return Upload.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+    def get_locked_upload(self, pk):
+        # Части одной загрузки записываются строго по очереди
+        return get_object_or_404(
+            self.get_queryset().select_for_update(), pk=pk
+        )
+
+    @action(
+        methods=['post'],
+        detail=True,
+        parser_classes=(MultiPartParser,),
+    )
+    def chunks(self, request, pk=None):
+        """Загрузить часть файла"""
+        with transaction.atomic():
+            upload = self.get_locked_upload(pk)
+            serializer = UploadChunkSerializer(
+                data=request.data,
+                context={'request': request, 'upload': upload}
+            )
+            serializer.is_valid(raise_exception=True)
+            if not upload.append_chunk(**serializer.validated_data):
+                return Response(
+                    {
+                        'detail': 'Контрольная сумма части не совпадает.',
+                        'offset': upload.offset,
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        return Response(UploadSerializer(upload).data)
+
+    @action(methods=['post'], detail=True)
+    def finalize(self, request, pk=None):
+        """Завершить загрузку"""
+        with transaction.atomic():
+            upload = self.get_locked_upload(pk)
+            if not upload.is_complete and not upload.finalize():
+                return Response(
+                    {
+                        'detail': 'Файл загружен не полностью или повреждён.',
+                        'offset': upload.offset,
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        return Response(UploadSerializer(upload).data)
+
+
+class MediaView(APIView):
+    """
+    Отдача файлов чатов только участникам чата.
+    Байты файла отдаёт nginx через X-Accel-Redirect, включая
+    запросы с Range. Без nginx файл отдаёт Django (для разработки).
+    """
+
+    permission_classes = [
+        IsAuthenticated,
+    ]
+    cache_control = 'private, max-age=31536000, immutable'
+    fallback_cache_control = 'private, no-cache'
+
+    def has_access(self, user, name):
+        # Доступ к уменьшенной копии такой же, как к исходному файлу
+        name = get_original_name(name) or name
+        chats = PersonalChat.objects.filter(
+            Q(participant_low=user) | Q(participant_high=user)
+        ).values('pk')
+        if Attachment.objects.filter(
+            file=name, message__chat__in=chats
+        ).exists():
+            return True
+        # Файлы сообщений, отправленных до появления вложений
+        return Message.objects.filter(
+            Q(file_to_send=name) |
+            Q(photo_to_send=name) |
+            Q(voice_message=name),
+            chat__in=chats
+        ).exists()
+
+    def serve(self, path, size, content_type, headers):
+        byte_range = parse_range(self.request.headers.get('Range'), size)
+        if byte_range is None:
+            return FileResponse(
+                open(path, 'rb'), content_type=content_type, headers=headers
+            )
+        start, end = byte_range
+        if start >= size or start > end:
+            return HttpResponse(
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={'Content-Range': f'bytes */{size}'}
+            )
+        response = StreamingHttpResponse(
+            iter_file_range(path, start, end),
+            status=status.HTTP_206_PARTIAL_CONTENT,
+            content_type=content_type,
+            headers=headers
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        return response
+
+    @extend_schema(
+        tags=['media'],
+        summary='Получить файл из чата',
+        description=(
+            'Отдать файл, голосовое сообщение или фото участнику чата. '
+            'Поддерживаются запросы с Range и If-None-Match'
+        ),
+        responses={(200, '*/*'): OpenApiTypes.BINARY},
+    )
+    def get(self, request, path):
+        name = posixpath.normpath(path)
+        if name.startswith(('.', '/')) or not self.has_access(
+            request.user, name
+        ):
+            raise NotFound
+        cache_control = self.cache_control
+        try:
+            stat = os.stat(default_storage.path(name))
+        except FileNotFoundError:
+            original = get_original_name(name)
+            if not original:
+                raise NotFound
+            # Копия ещё не создана: отдаётся исходный файл,
+            # без долгого кэширования под адресом копии
+            name = original
+            cache_control = self.fallback_cache_control
+            try:
+                stat = os.stat(default_storage.path(name))
+            except FileNotFoundError:
+                raise NotFound
+        full_path = default_storage.path(name)
+
+        etag = get_file_etag(name, stat)
+        headers = {
+            'ETag': etag,
+            'Cache-Control': cache_control,
+            'Accept-Ranges': 'bytes',
+        }
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return HttpResponseNotModified(headers=headers)
+
+        content_type = (
+            mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        )
+        if not settings.MEDIA_ACCEL_REDIRECT_PREFIX:
+            return self.serve(full_path, stat.st_size, content_type, headers)
+        # Python не копирует байты файла, отдачу выполняет nginx
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') +
+            '/' + quote(name)
+        )
+        return response
+
+
+class WebSocketStatsView(APIView):
+    """
+    Счётчики отставания клиентов WebSocket по ping/pong.
+    Счётчики свои у каждого процесса, ответ содержит host и pid.
+    """
+
+    permission_classes = [
+        IsAdminUser,
+    ]
+
+    @extend_schema(
+        tags=['chats'],
+        summary='Статистика WebSocket-подключений процесса',
+        description=(
+            'Подключения, отстающие клиенты и наибольшая задержка pong, '
+            'придержанные и объединённые кадры, отключённые медленные '
+            'клиенты'
+        ),
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    def get(self, request):
+        return Response(get_stats())
+
+
+class CacheStatsView(APIView):
+    """
+    Счётчики попаданий двухуровневого кэша.
+    Счётчики свои у каждого процесса, ответ содержит host и pid.
+    """
+
+    permission_classes = [
+        IsAdminUser,
+    ]
+
+    @extend_schema(
+        tags=['chats'],
+        summary='Статистика кэша процесса',
+        description=(
+            'Попадания в память процесса и в общий кэш, промахи '
+            'и число записей в памяти процесса'
+        ),
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    def get(self, request):
+        # Счётчики есть только у двухуровневого кэша core.cache
+        return Response(getattr(cache, 'get_stats', dict)())
@@ -0,0 +1,100 @@
+"""Обработка голосовых сообщений."""
+
+import subprocess
+from array import array
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from core.constants import (FILE_CHUNK_SIZE, VOICE_SAMPLE_RATE,
+                            VOICE_WAVEFORM_PEAKS)
+
+from .models import Chat, Message
+
+# Пики сначала считаются по окнам в 10 мс
+WINDOW_SAMPLES = VOICE_SAMPLE_RATE // 100
+
+
+def decode_pcm(path):
+    """
+    Декодировать аудио через ffmpeg в 16-битный моно PCM.
+    Данные читаются из конвейера частями, без загрузки файла в память.
+    """
+    process = subprocess.Popen(
+        [
+            'ffmpeg', '-v', 'error', '-i', path,
+            '-f', 's16le', '-ac', '1', '-ar', str(VOICE_SAMPLE_RATE), '-',
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while chunk := process.stdout.read(FILE_CHUNK_SIZE):
+            yield chunk
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, 'ffmpeg')
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def compress_peaks(window_peaks, count):
+    """
+    Сжать пики окон до count значений и привести к шкале 0-255
+    относительно самого громкого места.
+    """
+    peaks = array('B')
+    if not window_peaks:
+        return peaks
+    top = max(window_peaks) or 1
+    total = len(window_peaks)
+    count = min(count, total)
+    for i in range(count):
+        part = window_peaks[i * total // count:(i + 1) * total // count]
+        peaks.append(max(part) * 255 // top)
+    return peaks
+
+
+def measure(pcm_chunks, count=VOICE_WAVEFORM_PEAKS):
+    """Вернуть длительность в секундах и пики формы волны."""
+    window_peaks = array('H')
+    samples = array('h')
+    total_samples = 0
+    rest = b''
+    for chunk in pcm_chunks:
+        chunk = rest + chunk
+        size = len(chunk) - len(chunk) % 2
+        rest = chunk[size:]
+        samples.frombytes(chunk[:size])
+        total_samples += size // 2
+        full = len(samples) - len(samples) % WINDOW_SAMPLES
+        for start in range(0, full, WINDOW_SAMPLES):
+            window = samples[start:start + WINDOW_SAMPLES]
+            window_peaks.append(max(max(window), -min(window)))
+        del samples[:full]
+    if samples:
+        window_peaks.append(max(max(samples), -min(samples)))
+    duration = total_samples / VOICE_SAMPLE_RATE
+    return duration, compress_peaks(window_peaks, count)
+
+
+def process_voice_message(message_id, name):
+    """Посчитать длительность и форму волны голосового сообщения."""
+    duration, peaks = measure(decode_pcm(default_storage.path(name)))
+    chat_id = Message.objects.filter(
+        pk=message_id
+    ).values_list('chat_id', flat=True).first()
+    if chat_id is None:
+        return
+    # update, а не save: сообщение не считается отредактированным,
+    # но получает новый номер изменения, чтобы клиенты догрузили
+    # длительность и форму волны через синхронизацию
+    with transaction.atomic():
+        Message.objects.filter(pk=message_id).update(
+            voice_duration=duration,
+            voice_waveform=peaks.tobytes(),
+            change_seq=Chat.allocate_seq(chat_id),
+        )
@@ -0,0 +1,230 @@
+"""
+Двухуровневый кэш.
+Перед общим кэшем (Redis, без CACHE_REDIS_URL - память процесса)
+стоит ограниченный LRU в памяти процесса с коротким временем
+жизни записей. Чтение горячих ключей не ходит
+по сети, запись идёт в оба уровня. Записи, изменённые другими
+процессами, видны здесь не позже чем через LOCAL_TIMEOUT секунд.
+"""
+
+import os
+import pickle
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Хранилища и счётчики общие для всех потоков процесса,
+# как у LocMemCache: caches[...] создаёт экземпляр на каждый поток
+_stores = {}
+_stores_lock = threading.Lock()
+
+_MISSING = object()
+
+
+class LocalStore:
+    """LRU-хранилище процесса со счётчиками попаданий."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+
+def get_store(name):
+    with _stores_lock:
+        return _stores.setdefault(name, LocalStore())
+
+
+class TieredCache(BaseCache):
+    """
+    Кэш процесса перед общим кэшем.
+    OPTIONS:
+        SHARED_CACHE - алиас общего кэша в CACHES;
+        MAX_ENTRIES - максимум записей в памяти процесса;
+        LOCAL_TIMEOUT - время жизни записи в памяти процесса, секунд.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED_CACHE', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 2)
+        self._store = get_store(location or self.shared_alias)
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def get_timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get_local_timeout(self, timeout):
+        if timeout is None:
+            return self.local_timeout
+        return min(self.local_timeout, timeout)
+
+    def local_get(self, key):
+        store = self._store
+        with store.lock:
+            item = store.data.get(key)
+            if item is None:
+                return _MISSING
+            pickled, expires_at = item
+            if expires_at <= time.monotonic():
+                del store.data[key]
+                return _MISSING
+            store.data.move_to_end(key)
+            store.local_hits += 1
+        return pickle.loads(pickled)
+
+    def local_set(self, key, value, timeout):
+        local_timeout = self.get_local_timeout(timeout)
+        if local_timeout <= 0:
+            self.local_delete(key)
+            return
+        # Как и LocMemCache, храним копию: изменения объекта
+        # вызывающим кодом не должны попадать в кэш
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        store = self._store
+        with store.lock:
+            store.data[key] = (pickled, time.monotonic() + local_timeout)
+            store.data.move_to_end(key)
+            while len(store.data) > self._max_entries:
+                store.data.popitem(last=False)
+
+    def local_delete(self, key):
+        store = self._store
+        with store.lock:
+            store.data.pop(key, None)
+
+    def count_shared(self, hits, misses):
+        store = self._store
+        with store.lock:
+            store.shared_hits += hits
+            store.misses += misses
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.local_get(local_key)
+        if value is not _MISSING:
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.count_shared(0, 1)
+            return default
+        self.count_shared(1, 0)
+        self.local_set(local_key, value, None)
+        return value
+
+    def get_many(self, keys, version=None):
+        result = {}
+        missing = []
+        for key in keys:
+            value = self.local_get(
+                self.make_and_validate_key(key, version=version)
+            )
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                result[key] = value
+        if missing:
+            found = self.shared.get_many(missing, version=version)
+            self.count_shared(len(found), len(missing) - len(found))
+            for key, value in found.items():
+                self.local_set(
+                    self.make_key(key, version=version), value, None
+                )
+            result.update(found)
+        return result
+
+    def has_key(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        if self.local_get(local_key) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_timeout(timeout)
+        self.shared.set(key, value, timeout, version=version)
+        self.local_set(local_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_timeout(timeout)
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            local_key = self.make_and_validate_key(key, version=version)
+            if key in failed:
+                self.local_delete(local_key)
+            else:
+                self.local_set(local_key, value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_timeout(timeout)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self.local_set(local_key, value, timeout)
+        else:
+            # Локальная копия могла устареть, раз ключ уже существует
+            self.local_delete(local_key)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_timeout(timeout)
+        self.local_delete(local_key)
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        # Атомарность счётчиков обеспечивает только общий кэш
+        local_key = self.make_and_validate_key(key, version=version)
+        try:
+            value = self.shared.incr(key, delta, version=version)
+        except ValueError:
+            self.local_delete(local_key)
+            raise
+        self.local_set(local_key, value, None)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.local_delete(local_key)
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.local_delete(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        self.clear_local()
+        self.shared.clear()
+
+    def clear_local(self):
+        store = self._store
+        with store.lock:
+            store.data.clear()
+
+    def get_stats(self):
+        """Счётчики попаданий процесса с момента запуска."""
+        store = self._store
+        with store.lock:
+            return {
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'local_hits': store.local_hits,
+                'shared_hits': store.shared_hits,
+                'misses': store.misses,
+                'local_entries': len(store.data),
+            }
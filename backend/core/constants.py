@@ -72,3 +72,87 @@ USERS_GOALS = {
 GOALS_ICONS_URLS = 'core/icons/goals/'
 
 MAX_MESSAGE_LENGTH = 10000
+
+# Длина превью последнего сообщения в списке чатов
+MESSAGE_PREVIEW_LENGTH = 100
+# Длина идентификатора сообщения, который задаёт клиент для повторов
+CLIENT_ID_MAX_LENGTH = 64
+
+# Размер части при потоковой записи и чтении файлов
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Поля сообщения, в которые можно прикрепить загрузку по частям
+UPLOAD_KINDS = (
+    ('file_to_send', 'Файл'),
+    ('photo_to_send', 'Фото'),
+    ('voice_message', 'Голосовое сообщение'),
+)
+
+# Максимальный размер одной части при загрузке по частям
+UPLOAD_CHUNK_MAX_SIZE = 5 * 1024 * 1024
+
+# Каталог уменьшенных копий изображений в MEDIA_ROOT
+RENDITIONS_DIR = 'renditions'
+# Размеры уменьшенных копий (по большей стороне) аватаров и фото в чатах
+AVATAR_RENDITION_SIZES = {'small': 64, 'medium': 256}
+PHOTO_RENDITION_SIZES = {'small': 320, 'large': 1280}
+RENDITION_QUALITY = 80
+
+# Частота дискретизации при анализе голосовых сообщений
+VOICE_SAMPLE_RATE = 8000
+# Количество пиков формы волны голосового сообщения
+VOICE_WAVEFORM_PEAKS = 64
+
+# Конфигурации полнотекстового поиска по сообщениям
+SEARCH_CONFIGS = ('simple', 'english', 'russian')
+# Теги подсветки найденных слов в результатах поиска
+SEARCH_HIGHLIGHT_START = '<mark>'
+SEARCH_HIGHLIGHT_STOP = '</mark>'
+
+# Сколько секунд после последнего запроса пользователь считается онлайн
+PRESENCE_TIMEOUT = 300
+# Не чаще чем раз в столько секунд процесс обновляет кэш присутствия
+PRESENCE_CACHE_INTERVAL = 15
+# Раз в столько секунд last_activity сохраняется в БД одним запросом
+PRESENCE_FLUSH_INTERVAL = 60
+# Количество пользователей в одном запросе сохранения last_activity
+PRESENCE_FLUSH_BATCH_SIZE = 1000
+# Интервал сообщений heartbeat от клиента в канале присутствия
+PRESENCE_HEARTBEAT_INTERVAL = 30
+# Через сколько секунд после отключения рассылается статус оффлайн
+PRESENCE_OFFLINE_DELAY = 5
+
+# Сколько секунд хранится в кэше снимок пользователя для аутентификации
+USER_SNAPSHOT_TIMEOUT = 600
+# Параметр строки запроса с токеном для WebSocket-подключения
+WS_TOKEN_QUERY_PARAM = 'token'
+# Подпротокол, за которым браузер передаёт токен: ['access_token', <токен>]
+WS_TOKEN_SUBPROTOCOL = 'access_token'
+
+# Повторное начало набора текста рассылается не чаще раза в столько секунд
+TYPING_THROTTLE_INTERVAL = 3
+# Через сколько секунд без новых событий набор текста считается законченным
+TYPING_TIMEOUT = 6
+
+# Сколько сообщений отдаёт догрузка пропущенных изменений чата
+SYNC_PAGE_SIZE = 200
+SYNC_MAX_PAGE_SIZE = 1000
+
+# Сколько событий outbox рассылается за один проход
+OUTBOX_BATCH_SIZE = 100
+# После стольких неудачных попыток событие outbox удаляется:
+# клиенты догрузят пропущенное по номеру изменения
+OUTBOX_MAX_ATTEMPTS = 5
+# Задержка перед повторной отправкой, секунды, растёт с каждой попыткой
+OUTBOX_RETRY_DELAY = 5
+# На сколько секунд партия outbox занимается процессом на время рассылки
+OUTBOX_CLAIM_TIMEOUT = 60
+
+# Интервал кадров ping WebSocket-подключения, секунд. Клиент,
+# не ответивший за интервал, считается отстающим
+WS_PING_INTERVAL = 15
+# Клиент, не ответивший на ping за столько секунд, отключается
+WS_PONG_TIMEOUT = 60
+# Код закрытия для медленного клиента: переподключиться и догрузить
+# пропущенное через sync
+WS_CLOSE_SLOW_CONSUMER = 4013
@@ -0,0 +1,187 @@
+"""
+Базовый WebSocket-консьюмер, следящий за отставанием клиента.
+Daphne не сообщает о заполнении буфера сокета: send() возвращается
+сразу, и очередь на стороне сервера не растёт. Поэтому отставание
+измеряется по ответам клиента: при подключении и затем раз
+в WS_PING_INTERVAL секунд отправляется кадр ping, клиент отвечает
+кадром pong с тем же id.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import time
+
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from core.constants import (WS_CLOSE_SLOW_CONSUMER, WS_PING_INTERVAL,
+                            WS_PONG_TIMEOUT)
+
+# Счётчики процесса. Консьюмеры работают в одном event loop,
+# поэтому блокировка не нужна
+stats = {
+    'connections': 0,
+    'lagging_connections': 0,
+    'max_pong_lag': 0.0,
+    'sent_frames': 0,
+    'held_frames': 0,
+    'coalesced_frames': 0,
+    'evicted_connections': 0,
+}
+
+
+def get_stats():
+    """Счётчики отставания клиентов этого процесса."""
+    return {
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        **stats,
+    }
+
+
+class PingingWebsocketConsumer(AsyncWebsocketConsumer):
+    """
+    Консьюмер с измерением отставания клиента по ping/pong.
+    Кадры ping отправляются только при ping_enabled: протокол
+    эндпоинтов, клиенты которых не знают о ping, не меняется.
+    Клиент отстаёт, если не ответил на ping дольше WS_PING_INTERVAL.
+    Пока клиент отстаёт, кадры с ключом coalesce_key (набор текста,
+    статусы) придерживаются, новый кадр заменяет придержанный с тем же
+    ключом. Придержанные кадры уходят после ответа клиента или перед
+    следующим кадром без ключа, порядок кадров не меняется.
+    Клиент, не ответивший за WS_PONG_TIMEOUT, отключается с кодом
+    WS_CLOSE_SLOW_CONSUMER: он переподключается и догружает пропущенное
+    по номеру изменения. Отсчёт начинается с первого ping при
+    подключении, поэтому молчащий клиент тоже отключается.
+    Наследники обрабатывают входящие кадры в receive_frame, кадры
+    не в формате JSON-объекта отклоняются кадром error.
+    """
+
+    ping_enabled = False
+    pinger = None
+    ping_id = 0
+    ping_sent_at = None
+    lagging = False
+    evicted = False
+    counted = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.held_frames = {}
+
+    async def accept(self, subprotocol=None):
+        await super().accept(subprotocol)
+        self.counted = True
+        stats['connections'] += 1
+        if self.ping_enabled:
+            self.pinger = asyncio.ensure_future(self.ping_periodically())
+
+    async def websocket_disconnect(self, message):
+        self.stop_pinger()
+        if self.counted:
+            self.counted = False
+            stats['connections'] -= 1
+        await super().websocket_disconnect(message)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data) if text_data is not None else None
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            await self.send_error('Некорректный кадр.')
+            return
+        if data.get('type') == 'pong':
+            await self.receive_pong(data)
+            return
+        await self.receive_frame(data)
+
+    async def receive_frame(self, data):
+        """Обработать входящий кадр, кроме pong."""
+
+    async def send_error(self, detail):
+        await self.send_frame(json.dumps({
+            'type': 'error',
+            'detail': detail,
+        }))
+
+    def get_lag(self):
+        """Сколько секунд клиент не отвечает на ping."""
+        if self.ping_sent_at is None:
+            return 0
+        return time.monotonic() - self.ping_sent_at
+
+    def set_lagging(self, lagging):
+        if lagging != self.lagging:
+            self.lagging = lagging
+            stats['lagging_connections'] += 1 if lagging else -1
+
+    async def ping_periodically(self):
+        while True:
+            if self.ping_sent_at is None:
+                await self.send_ping()
+            elif self.get_lag() < WS_PONG_TIMEOUT:
+                self.set_lagging(True)
+            else:
+                await self.evict()
+                return
+            await asyncio.sleep(WS_PING_INTERVAL)
+
+    async def send_ping(self):
+        self.ping_id += 1
+        self.ping_sent_at = time.monotonic()
+        await self.send(text_data=json.dumps({
+            'type': 'ping',
+            'id': self.ping_id,
+        }))
+
+    async def receive_pong(self, data):
+        # Ответ на устаревший ping не снимает отставание
+        if self.ping_sent_at is None or data.get('id') != self.ping_id:
+            return
+        stats['max_pong_lag'] = max(
+            stats['max_pong_lag'], round(self.get_lag(), 3)
+        )
+        self.ping_sent_at = None
+        self.set_lagging(False)
+        await self.send_held_frames()
+
+    async def send_frame(self, text_data, coalesce_key=None):
+        """Отправить кадр клиенту или придержать, пока клиент отстаёт."""
+        if self.evicted:
+            return
+        if coalesce_key is not None and self.lagging:
+            if coalesce_key in self.held_frames:
+                stats['coalesced_frames'] += 1
+            else:
+                stats['held_frames'] += 1
+            self.held_frames[coalesce_key] = text_data
+            return
+        await self.send_held_frames()
+        await self.send(text_data=text_data)
+        stats['sent_frames'] += 1
+
+    async def send_held_frames(self):
+        held_frames = list(self.held_frames.values())
+        self.held_frames.clear()
+        stats['held_frames'] -= len(held_frames)
+        for text_data in held_frames:
+            await self.send(text_data=text_data)
+            stats['sent_frames'] += 1
+
+    def stop_pinger(self):
+        if self.pinger is not None:
+            self.pinger.cancel()
+            self.pinger = None
+        self.set_lagging(False)
+        stats['held_frames'] -= len(self.held_frames)
+        self.held_frames.clear()
+
+    async def evict(self):
+        """Отключить клиента, который не успевает принимать кадры."""
+        self.evicted = True
+        stats['evicted_connections'] += 1
+        self.pinger = None
+        self.stop_pinger()
+        await self.close(code=WS_CLOSE_SLOW_CONSUMER)
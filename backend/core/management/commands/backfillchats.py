@@ -0,0 +1,244 @@
+"""Кастомная команда заполнения служебных данных чатов."""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import (Count, F, IntegerField, Max, OuterRef, Subquery,
+                              Value)
+from django.db.models.functions import Coalesce, Greatest, Least, Substr
+
+from chats.models import Chat, ChatReadState, Message, PersonalChat
+from core.constants import MESSAGE_PREVIEW_LENGTH
+
+
+class Command(BaseCommand):
+    """Команда переноса и пересчёта служебных данных чатов"""
+
+    help = (
+        'Сливает дубли личных чатов одной пары участников, '
+        'переносит отметки прочтения из Message.read_by в ChatReadState, '
+        'заполняет последнее сообщение, счётчики непрочитанных '
+        'и номера сообщений в чатах. '
+        'Повторный запуск безопасен'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одном запросе',
+        )
+
+    def save_read_states(self, batch):
+        # Уже существующие отметки новее перенесённых, их не трогаем
+        ChatReadState.objects.bulk_create(batch, ignore_conflicts=True)
+        return len(batch)
+
+    def backfill_read_states(self, batch_size):
+        read_marks = Message.read_by.through.objects.values(
+            'message__chat_id', 'user_id'
+        ).annotate(last_read=Max('message_id')).order_by()
+        batch = []
+        cnt = 0
+        for row in read_marks.iterator(chunk_size=batch_size):
+            batch.append(ChatReadState(
+                chat_id=row['message__chat_id'],
+                user_id=row['user_id'],
+                last_read_message_id=row['last_read'],
+            ))
+            if len(batch) >= batch_size:
+                cnt += self.save_read_states(batch)
+                batch = []
+        if batch:
+            cnt += self.save_read_states(batch)
+        return cnt
+
+    def create_missing_read_states(self, batch_size):
+        participants = PersonalChat.objects.values_list(
+            'pk', 'initiator_id', 'receiver_id'
+        ).order_by()
+        batch = []
+        cnt = 0
+        for chat_id, *user_ids in participants.iterator(chunk_size=batch_size):
+            batch.extend(
+                ChatReadState(chat_id=chat_id, user_id=user_id)
+                for user_id in user_ids if user_id is not None
+            )
+            if len(batch) >= batch_size:
+                cnt += self.save_read_states(batch)
+                batch = []
+        if batch:
+            cnt += self.save_read_states(batch)
+        return cnt
+
+    def save_participant_pairs(self, batch):
+        PersonalChat.objects.bulk_update(
+            batch, ['participant_low', 'participant_high']
+        )
+        return len(batch)
+
+    def get_pair_annotations(self):
+        return {
+            'low': Least('initiator_id', 'receiver_id'),
+            'high': Greatest('initiator_id', 'receiver_id'),
+        }
+
+    def merge_chats(self, survivor, duplicates):
+        ids = [chat.pk for chat in duplicates]
+        # Номера перенесённым сообщениям выдаст backfill_sequences
+        Message.objects.filter(chat_id__in=ids).update(
+            chat=survivor, seq=None, change_seq=None
+        )
+        survivor.blocked_users.add(*Chat.blocked_users.through.objects.filter(
+            chat_id__in=ids
+        ).values_list('user_id', flat=True))
+        # Отметка прочтения берётся самая поздняя из всех чатов пары
+        read_marks = ChatReadState.objects.filter(
+            chat_id__in=ids
+        ).values('user_id').annotate(
+            last_read=Max('last_read_message_id')
+        ).order_by()
+        for row in read_marks:
+            state, _ = ChatReadState.objects.get_or_create(
+                chat=survivor, user_id=row['user_id']
+            )
+            if (row['last_read'] or 0) > (state.last_read_message_id or 0):
+                state.last_read_message_id = row['last_read']
+                state.save(update_fields=['last_read_message'])
+        PersonalChat.objects.filter(pk__in=ids).delete()
+
+    def merge_duplicate_chats(self):
+        """
+        Слить личные чаты одной пары участников в один.
+        Остаётся чат, у которого уже заполнена пара, иначе самый ранний.
+        """
+        pairs = PersonalChat.objects.filter(
+            initiator__isnull=False, receiver__isnull=False
+        ).annotate(**self.get_pair_annotations()).values(
+            'low', 'high'
+        ).annotate(cnt=Count('pk')).filter(cnt__gt=1).order_by()
+        cnt = 0
+        for pair in pairs:
+            with transaction.atomic():
+                survivor, *duplicates = PersonalChat.objects.annotate(
+                    **self.get_pair_annotations()
+                ).filter(
+                    low=pair['low'], high=pair['high']
+                ).select_for_update().order_by(
+                    F('participant_low').asc(nulls_last=True), 'pk'
+                )
+                self.merge_chats(survivor, duplicates)
+            cnt += len(duplicates)
+        return cnt
+
+    def backfill_participant_pairs(self, batch_size):
+        # Дубли пар уже слиты. У чата без одного из участников
+        # оставшийся записывается в participant_low
+        chats = PersonalChat.objects.filter(
+            participant_low__isnull=True,
+            participant_high__isnull=True,
+        ).exclude(
+            initiator__isnull=True, receiver__isnull=True
+        ).only('pk', 'initiator_id', 'receiver_id')
+        batch = []
+        cnt = 0
+        for chat in chats.iterator(chunk_size=batch_size):
+            user_ids = sorted(
+                user_id for user_id in (chat.initiator_id, chat.receiver_id)
+                if user_id is not None
+            )
+            chat.participant_low_id = user_ids[0]
+            chat.participant_high_id = (
+                user_ids[-1] if len(user_ids) > 1 else None
+            )
+            batch.append(chat)
+            if len(batch) >= batch_size:
+                cnt += self.save_participant_pairs(batch)
+                batch = []
+        if batch:
+            cnt += self.save_participant_pairs(batch)
+        return cnt
+
+    def backfill_last_messages(self):
+        last_message = Message.objects.filter(
+            chat_id=OuterRef('id')
+        ).order_by('-timestamp', '-id')
+        return Chat.objects.update(
+            last_message_id=Subquery(last_message.values('id')[:1]),
+            last_message_sender_id=Subquery(
+                last_message.values('sender_id')[:1]
+            ),
+            last_message_at=Subquery(last_message.values('timestamp')[:1]),
+            last_message_preview=Coalesce(
+                Substr(
+                    Subquery(last_message.values('text')[:1]),
+                    1,
+                    MESSAGE_PREVIEW_LENGTH
+                ),
+                Value('')
+            ),
+        )
+
+    def backfill_unread_counts(self):
+        unread = Message.objects.filter(
+            chat_id=OuterRef('chat_id'),
+            id__gt=Coalesce(OuterRef('last_read_message_id'), 0),
+        ).exclude(
+            sender_id=OuterRef('user_id')
+        ).order_by().values('chat_id').annotate(cnt=Count('id')).values('cnt')
+        return ChatReadState.objects.update(
+            unread_count=Coalesce(
+                Subquery(unread, output_field=IntegerField()), 0
+            )
+        )
+
+    def backfill_sequences(self, batch_size):
+        # Номера выдаются после уже выданных новым сообщениям,
+        # счётчик чата не уходит назад
+        chat_ids = list(Message.objects.filter(
+            seq__isnull=True
+        ).values_list('chat_id', flat=True).distinct().order_by())
+        cnt = 0
+        for chat_id in chat_ids:
+            with transaction.atomic():
+                message_ids = list(Message.objects.filter(
+                    chat_id=chat_id, seq__isnull=True
+                ).order_by('timestamp', 'id').values_list('pk', flat=True))
+                first_seq = Chat.allocate_seq(
+                    chat_id, len(message_ids)
+                ) - len(message_ids) + 1
+                Message.objects.bulk_update(
+                    [
+                        Message(pk=pk, seq=seq, change_seq=seq)
+                        for seq, pk in enumerate(message_ids, first_seq)
+                    ],
+                    ['seq', 'change_seq'],
+                    batch_size=batch_size
+                )
+            cnt += len(message_ids)
+        return cnt
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Merging duplicate personal chats...')
+        cnt = self.merge_duplicate_chats()
+        self.stdout.write(f'{cnt} chats was merged')
+        self.stdout.write('Moving read marks to ChatReadState...')
+        cnt = self.backfill_read_states(batch_size)
+        self.stdout.write(f'{cnt} read marks was moved')
+        self.stdout.write('Creating missing read marks...')
+        cnt = self.create_missing_read_states(batch_size)
+        self.stdout.write(f'{cnt} participants was checked')
+        self.stdout.write('*********')
+        self.stdout.write('Filling participant pairs...')
+        cnt = self.backfill_participant_pairs(batch_size)
+        self.stdout.write(f'{cnt} chats was updated')
+        self.stdout.write('Filling last messages...')
+        cnt = self.backfill_last_messages()
+        self.stdout.write(f'{cnt} chats was updated')
+        self.stdout.write('Counting unread messages...')
+        cnt = self.backfill_unread_counts()
+        self.stdout.write(f'{cnt} read marks was updated')
+        self.stdout.write('Numbering messages...')
+        cnt = self.backfill_sequences(batch_size)
+        self.stdout.write(f'{cnt} messages was numbered')
@@ -0,0 +1,119 @@
+"""Кастомная команда замера скорости аутентификации WebSocket-подключений."""
+
+import asyncio
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.middleware import WebSocketJWTAuthMiddleware
+from core.constants import WS_TOKEN_SUBPROTOCOL
+from users.models import User
+from users.snapshot import invalidate_snapshot
+
+
+async def accept(scope, receive, send):
+    """Приложение-заглушка: принимает подключение сразу."""
+    await send({'type': 'websocket.accept', 'subprotocol': None})
+
+
+async def receive():
+    return {'type': 'websocket.connect'}
+
+
+async def send(message):
+    pass
+
+
+class Command(BaseCommand):
+    """Команда замера подключений в секунду с холодным и прогретым кэшем"""
+
+    help = (
+        'Прогоняет WebSocket-рукопожатия через WebSocketJWTAuthMiddleware '
+        'для существующих пользователей и выводит подключения в секунду'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--handshakes',
+            type=int,
+            default=5000,
+            help='Количество рукопожатий в одном замере',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=500,
+            help='Количество разных пользователей',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=100,
+            help='Количество одновременных рукопожатий',
+        )
+
+    def get_scopes(self, user_ids, handshakes):
+        tokens = [
+            str(AccessToken.for_user(User(pk=user_id)))
+            for user_id in user_ids
+        ]
+        # Способы передачи токена чередуются как у реальных клиентов
+        scopes = []
+        for i in range(handshakes):
+            token = tokens[i % len(tokens)]
+            scope = {'type': 'websocket', 'headers': [], 'subprotocols': []}
+            match i % 3:
+                case 0:
+                    scope['headers'] = [
+                        (b'authorization', f'Bearer {token}'.encode())
+                    ]
+                case 1:
+                    scope['query_string'] = f'token={token}'.encode()
+                case _:
+                    scope['subprotocols'] = [WS_TOKEN_SUBPROTOCOL, token]
+            scopes.append(scope)
+        return scopes
+
+    async def run_handshakes(self, scopes, concurrency):
+        middleware = WebSocketJWTAuthMiddleware(accept)
+        start = time.perf_counter()
+        for i in range(0, len(scopes), concurrency):
+            await asyncio.gather(*(
+                middleware(scope, receive, send)
+                for scope in scopes[i:i + concurrency]
+            ))
+        return time.perf_counter() - start
+
+    def measure(self, title, scopes, concurrency):
+        stats = getattr(cache, 'get_stats', dict)
+        before = stats()
+        elapsed = asyncio.run(self.run_handshakes(scopes, concurrency))
+        after = stats()
+        self.stdout.write(
+            f'{title}: {len(scopes) / elapsed:.0f} handshakes/s '
+            f'({len(scopes)} in {elapsed:.2f}s)'
+        )
+        if before:
+            self.stdout.write('  ' + ', '.join(
+                f'{name}: {after[name] - before[name]}'
+                for name in ('local_hits', 'shared_hits', 'misses')
+            ))
+
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.filter(
+            is_active=True
+        ).values_list('pk', flat=True)[:options['users']])
+        if not user_ids:
+            raise CommandError('No active users, load test users first')
+        scopes = self.get_scopes(user_ids, options['handshakes'])
+        self.stdout.write(
+            f'{len(scopes)} handshakes for {len(user_ids)} users, '
+            f'concurrency {options["concurrency"]}'
+        )
+        for user_id in user_ids:
+            invalidate_snapshot(user_id)
+        self.measure('Cold cache', scopes, options['concurrency'])
+        self.measure('Warm cache', scopes, options['concurrency'])
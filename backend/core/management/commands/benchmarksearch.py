@@ -0,0 +1,210 @@
+"""Кастомная команда замера полнотекстового поиска по сообщениям."""
+
+import random
+import statistics
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from chats.models import Chat, Message, PersonalChat
+from chats.views import ChatViewSet
+from users.models import User
+
+# Синтетический корпус лежит в чатах отдельных пользователей,
+# их адреса почты находятся в этом домене
+CORPUS_EMAIL_DOMAIN = 'benchmark.invalid'
+
+# Словарь корпуса: несколько словоформ одного слова проверяют
+# языковые конфигурации, редкое слово - выборочный запрос
+WORDS = (
+    'привет', 'как', 'дела', 'сегодня', 'завтра', 'встреча', 'встречи',
+    'путешествие', 'путешествия', 'путешествовать', 'кофе', 'работа',
+    'работе', 'учить', 'язык', 'языки', 'грамматика', 'слово', 'слова',
+    'спасибо', 'отлично', 'погода', 'музыка', 'фильм', 'книга', 'книгу',
+    'hello', 'how', 'are', 'you', 'today', 'tomorrow', 'meeting',
+    'meetings', 'travel', 'travelling', 'coffee', 'work', 'learn',
+    'language', 'languages', 'grammar', 'word', 'words', 'great',
+    'thanks', 'weather', 'music', 'movie', 'book',
+)
+RARE_WORD = 'аквариум'
+RARE_WORD_FREQUENCY = 0.0001
+
+
+class Command(BaseCommand):
+    """Команда сравнения поиска по GIN-индексу и по icontains"""
+
+    help = (
+        'Создаёт пользователей и синтетический корпус сообщений в их '
+        'чатах и сравнивает время поиска через эндпоинт chats/search '
+        '(GIN-индекс) и через text__icontains. Корпус сохраняется '
+        'между запусками, --clear удаляет его вместе с пользователями. '
+        'Только для PostgreSQL'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=2000000,
+            help='Размер корпуса сообщений',
+        )
+        parser.add_argument(
+            '--chats',
+            type=int,
+            default=100,
+            help='Количество чатов корпуса',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество сообщений в одной вставке',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Сколько раз выполнить каждый запрос',
+        )
+        parser.add_argument(
+            '--query',
+            action='append',
+            dest='queries',
+            help='Поисковый запрос, можно указать несколько раз',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Удалить корпус и завершить работу',
+        )
+
+    def get_corpus_users(self):
+        return User.objects.filter(email__endswith=f'@{CORPUS_EMAIL_DOMAIN}')
+
+    def get_corpus_chats(self):
+        users = self.get_corpus_users()
+        return PersonalChat.objects.filter(
+            participant_low__in=users, participant_high__in=users
+        )
+
+    def get_user(self, number):
+        user, _ = User.objects.get_or_create(
+            email=f'{number}@{CORPUS_EMAIL_DOMAIN}',
+            defaults={
+                'username': f'bench{number}',
+                'password': make_password(None),
+            }
+        )
+        return user
+
+    def get_chats(self, user, count):
+        chats = []
+        for number in range(1, count + 1):
+            other = self.get_user(number)
+            chat, _ = PersonalChat.objects.get_or_create(
+                **PersonalChat.get_pair_lookup(user, other),
+                defaults={'initiator': user, 'receiver': other}
+            )
+            chats.append((chat, other))
+        return chats
+
+    def get_text(self):
+        words = random.choices(WORDS, k=random.randint(3, 20))
+        if random.random() < RARE_WORD_FREQUENCY:
+            words[random.randrange(len(words))] = RARE_WORD
+        return ' '.join(words)
+
+    def insert_batch(self, user, chat, other, count):
+        with transaction.atomic():
+            last_seq = Chat.allocate_seq(chat.pk, count)
+            Message.objects.bulk_create([
+                Message(
+                    chat=chat,
+                    sender=(user, other)[seq % 2],
+                    text=self.get_text(),
+                    seq=seq,
+                    change_seq=seq,
+                )
+                for seq in range(last_seq - count + 1, last_seq + 1)
+            ])
+
+    def build_corpus(self, user, options):
+        chats = self.get_chats(user, options['chats'])
+        cnt = Message.objects.filter(
+            chat__in=self.get_corpus_chats()
+        ).count()
+        missing = options['messages'] - cnt
+        if missing <= 0:
+            self.stdout.write(f'Using existing corpus of {cnt} messages')
+            return
+        self.stdout.write(f'Building corpus: {missing} messages...')
+        batch_size = options['batch_size']
+        for i in range(0, missing, batch_size):
+            chat, other = chats[(i // batch_size) % len(chats)]
+            count = min(batch_size, missing - i)
+            self.insert_batch(user, chat, other, count)
+            cnt += count
+            self.stdout.write(f'{cnt} messages was created')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'ANALYZE {connection.ops.quote_name(Message._meta.db_table)}'
+            )
+
+    def search(self, user, query):
+        """Поиск через эндпоинт: запрос, ранжирование, сниппеты."""
+        request = APIRequestFactory().get(
+            '/api/v1/chats/search/', {'q': query}
+        )
+        force_authenticate(request, user=user)
+        response = ChatViewSet.as_view({'get': 'search'})(request)
+        if response.status_code != 200:
+            raise CommandError(f'Search failed: {response.data}')
+        return len(response.data['results'])
+
+    def search_icontains(self, user, query):
+        """Прежний способ: подстрока без индекса."""
+        chats = PersonalChat.objects.filter(
+            Q(participant_low=user) | Q(participant_high=user)
+        ).values('pk')
+        return len(Message.objects.filter(
+            chat__in=chats, text__icontains=query
+        ).order_by('-pk')[:20])
+
+    def measure(self, title, func, user, query, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            found = func(user, query)
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f'  {title}: median {statistics.median(timings):.1f} ms, '
+            f'max {max(timings):.1f} ms, {found} results'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Full-text search requires PostgreSQL')
+        if options['clear']:
+            deleted, _ = self.get_corpus_chats().delete()
+            deleted += self.get_corpus_users().delete()[0]
+            self.stdout.write(f'Done. {deleted} objects was deleted')
+            return
+        if options['chats'] < 1:
+            raise CommandError('Chats must be positive')
+        user = self.get_user(0)
+        self.build_corpus(user, options)
+        queries = options['queries'] or ['путешествие', 'meeting', RARE_WORD]
+        for query in queries:
+            self.stdout.write(f'Query "{query}":')
+            self.measure(
+                'GIN search', self.search, user, query, options['repeat']
+            )
+            self.measure(
+                'icontains', self.search_icontains, user, query,
+                options['repeat']
+            )
@@ -0,0 +1,222 @@
+"""Кастомная команда замера синхронного и асинхронного консьюмеров."""
+
+import asyncio
+import json
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from django.test.utils import override_settings
+from django.urls import re_path
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import WebsocketConsumer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chats.consumers import UserConsumer
+from chats.events import get_user_group_name
+from chats.models import PersonalChat
+from chats.serializers import ChatSyncParamsSerializer, ChatSyncSerializer
+from users.models import User
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+
+# Сколько последних изменений чата возвращает эхо-кадр sync
+ECHO_CHANGES = 10
+
+
+class SyncUserConsumer(WebsocketConsumer):
+    """
+    Синхронный вариант UserConsumer для сравнения, как прежний
+    ChatConsumer: обращения к channel layer идут через async_to_sync,
+    обработчики кадров выполняются в потоке.
+    """
+
+    def connect(self):
+        self.user = self.scope['user']
+        self.chats = {}
+        self.group_name = get_user_group_name(self.user.id)
+        async_to_sync(self.channel_layer.group_add)(
+            self.group_name, self.channel_name
+        )
+        self.accept()
+
+    def disconnect(self, close_code):
+        async_to_sync(self.channel_layer.group_discard)(
+            self.group_name, self.channel_name
+        )
+
+    def receive(self, text_data=None, bytes_data=None):
+        data = json.loads(text_data)
+        chat_id = data['chat_id']
+        if chat_id not in self.chats:
+            self.chats[chat_id] = PersonalChat.objects.get(pk=chat_id)
+        chat = self.chats[chat_id]
+        params = ChatSyncParamsSerializer(data=data)
+        params.is_valid(raise_exception=True)
+        changes = ChatSyncSerializer(
+            chat.get_changes(**params.validated_data)
+        ).data
+        self.send(text_data=json.dumps(
+            {'type': 'sync', 'chat_id': chat.pk, **changes}
+        ))
+
+
+def get_application(consumer_class):
+    return URLRouter([
+        re_path(r'ws/user/$', consumer_class.as_asgi()),
+    ])
+
+
+def get_percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    """Команда замера подключений на процесс и задержки эхо-кадра"""
+
+    help = (
+        'Открывает WebSocket-подключения через WebsocketCommunicator '
+        'и слой каналов в памяти для синхронного и асинхронного '
+        'консьюмеров, выводит скорость подключения, память на '
+        'подключение и задержку ответа на кадр sync (p50, p99)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections',
+            type=int,
+            default=1000,
+            help='Количество простаивающих подключений',
+        )
+        parser.add_argument(
+            '--frames',
+            type=int,
+            default=200,
+            help='Количество эхо-кадров для замера задержки',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=100,
+            help='Количество одновременных подключений',
+        )
+        parser.add_argument(
+            '--consumer',
+            choices=('sync', 'async', 'both'),
+            default='both',
+            help='Какой консьюмер замерять',
+        )
+
+    async def connect(self, application, users, concurrency):
+        communicators = []
+        for user in users:
+            communicator = WebsocketCommunicator(application, '/ws/user/')
+            communicator.scope['user'] = user
+            communicators.append(communicator)
+        for i in range(0, len(communicators), concurrency):
+            results = await asyncio.gather(*(
+                communicator.connect()
+                for communicator in communicators[i:i + concurrency]
+            ))
+            if not all(connected for connected, _ in results):
+                raise CommandError('WebSocket connection was rejected')
+        return communicators
+
+    async def disconnect(self, communicators, concurrency):
+        for i in range(0, len(communicators), concurrency):
+            await asyncio.gather(*(
+                communicator.disconnect()
+                for communicator in communicators[i:i + concurrency]
+            ))
+
+    async def echo(self, communicator, frame):
+        start = time.perf_counter()
+        await communicator.send_json_to(frame)
+        while True:
+            # Кадры других типов пропускаются
+            response = await communicator.receive_json_from(timeout=10)
+            if response['type'] == 'sync':
+                return time.perf_counter() - start
+
+    async def run(self, application, users, echo_user, frame, options):
+        tracemalloc.start()
+        memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        idle = await self.connect(
+            application, users, options['concurrency']
+        )
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0] - memory
+        tracemalloc.stop()
+        threads = threading.active_count()
+
+        [echo_client] = await self.connect(application, [echo_user], 1)
+        latencies = [
+            await self.echo(echo_client, frame)
+            for _ in range(options['frames'])
+        ]
+        await self.disconnect([echo_client, *idle], options['concurrency'])
+        return elapsed, memory, threads, latencies
+
+    def measure(self, title, consumer_class, users, echo_user, frame,
+                options):
+        application = get_application(consumer_class)
+        elapsed, memory, threads, latencies = asyncio.run(
+            self.run(application, users, echo_user, frame, options)
+        )
+        self.stdout.write(
+            f'{title}: {len(users) / elapsed:.0f} connections/s '
+            f'({len(users)} in {elapsed:.2f}s), '
+            f'{memory / len(users) / 1024:.1f} KiB per connection, '
+            f'{threads} threads'
+        )
+        self.stdout.write(
+            f'  echo latency: p50 {get_percentile(latencies, 0.5) * 1000:.2f}'
+            f' ms, p99 {get_percentile(latencies, 0.99) * 1000:.2f} ms '
+            f'({len(latencies)} frames)'
+        )
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1 or options['frames'] < 1:
+            raise CommandError('Connections and frames must be positive')
+        chat = PersonalChat.objects.filter(
+            participant_low__is_active=True
+        ).order_by(F('last_message_at').desc(nulls_last=True)).first()
+        if chat is None:
+            raise CommandError('No personal chats, load test data first')
+        active_users = list(
+            User.objects.filter(is_active=True)[:options['connections']]
+        )
+        users = [
+            active_users[i % len(active_users)]
+            for i in range(options['connections'])
+        ]
+        echo_user = chat.participant_low
+        frame = {
+            'type': 'sync',
+            'chat_id': chat.pk,
+            'since': max(chat.last_seq - ECHO_CHANGES, 0),
+        }
+        self.stdout.write(
+            f'{len(users)} idle connections for {len(active_users)} users, '
+            f'{options["frames"]} echo frames in chat {chat.pk}'
+        )
+        consumers = {
+            'sync': ('Sync consumer', SyncUserConsumer),
+            'async': ('Async consumer', UserConsumer),
+        }
+        if options['consumer'] != 'both':
+            consumers = {options['consumer']: consumers[options['consumer']]}
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+            for title, consumer_class in consumers.values():
+                self.measure(
+                    title, consumer_class, users, echo_user, frame,
+                    options
+                )
@@ -0,0 +1,77 @@
+"""Кастомная команда создания уменьшенных копий изображений."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from chats.models import Message
+from core.constants import AVATAR_RENDITION_SIZES, PHOTO_RENDITION_SIZES
+from core.renditions import create_renditions
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Команда создания копий для уже загруженных аватаров и фото"""
+
+    help = (
+        'Создаёт недостающие уменьшенные копии аватаров пользователей '
+        'и фото из чатов. Повторный запуск безопасен'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Количество изображений в одной партии',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Количество потоков обработки',
+        )
+
+    def create_batch(self, executor, names, sizes):
+        cnt = 0
+        futures = [
+            executor.submit(create_renditions, name, sizes) for name in names
+        ]
+        for name, future in zip(names, futures):
+            try:
+                cnt += future.result()
+            except Exception as e:
+                self.stderr.write(f'Error processing {name}: {e}')
+        return cnt
+
+    def create_renditions(self, executor, names, sizes, batch_size):
+        cnt = 0
+        batch = []
+        for name in names.iterator(chunk_size=batch_size):
+            batch.append(name)
+            if len(batch) >= batch_size:
+                cnt += self.create_batch(executor, batch, sizes)
+                batch = []
+        if batch:
+            cnt += self.create_batch(executor, batch, sizes)
+        return cnt
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            self.stdout.write('Creating avatar renditions...')
+            avatars = User.objects.exclude(avatar='').exclude(
+                avatar__isnull=True
+            ).values_list('avatar', flat=True).distinct()
+            cnt = self.create_renditions(
+                executor, avatars, AVATAR_RENDITION_SIZES, batch_size
+            )
+            self.stdout.write(f'{cnt} renditions was created')
+            self.stdout.write('Creating photo renditions...')
+            photos = Message.objects.exclude(photo_to_send='').exclude(
+                photo_to_send__isnull=True
+            ).values_list('photo_to_send', flat=True).distinct()
+            cnt = self.create_renditions(
+                executor, photos, PHOTO_RENDITION_SIZES, batch_size
+            )
+            self.stdout.write(f'{cnt} renditions was created')
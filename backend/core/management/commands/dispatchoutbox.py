@@ -0,0 +1,40 @@
+"""Кастомная команда рассылки событий outbox."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from chats.events import dispatch_pending
+from core.constants import OUTBOX_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """Команда рассылки событий, оставшихся в outbox"""
+
+    help = (
+        'Рассылает события outbox, не отправленные после фиксации '
+        'транзакции: отложенные после ошибки channel layer и оставшиеся '
+        'от остановленных процессов. Повторный запуск безопасен'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=OUTBOX_BATCH_SIZE,
+            help='Количество событий в одной партии',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Повторять рассылку через столько секунд, 0 - один проход',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            cnt = dispatch_pending(options['batch_size'])
+            self.stdout.write(f'{cnt} outbox events was sent')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
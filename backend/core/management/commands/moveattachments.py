@@ -0,0 +1,62 @@
+"""Кастомная команда переноса вложений из БД в файловое хранилище."""
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.models import Attachment, StoredFile
+
+
+class Command(BaseCommand):
+    """Команда переноса содержимого вложений из БД в файлы"""
+
+    help = (
+        'Переносит содержимое вложений из поля Attachment.content '
+        'в файловое хранилище партиями. Повторный запуск безопасен'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Количество вложений в одной партии',
+        )
+
+    def move_attachment(self, pk):
+        # Содержимое читаем по одному вложению, а не всю партию сразу
+        name, content = Attachment.objects.filter(
+            pk=pk
+        ).values_list('name', 'content').get()
+        upload = ContentFile(bytes(content), name=name)
+        stored_file = StoredFile.objects.store(upload)
+        Attachment.objects.filter(pk=pk).update(
+            stored_file=stored_file,
+            file=stored_file.file.name,
+            size=stored_file.size,
+            content_hash=stored_file.sha256,
+            content=None,
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Moving attachments to file storage...')
+        pending = Attachment.objects.filter(
+            content__isnull=False, file=''
+        ).order_by('pk').values_list('pk', flat=True)
+        cnt = 0
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for pk in batch:
+                try:
+                    self.move_attachment(pk)
+                except Exception as e:
+                    raise CommandError(
+                        'Error moving attachment %s: %s' % (pk, e)
+                    )
+            cnt += len(batch)
+            last_pk = batch[-1]
+            self.stdout.write(f'{cnt} attachments was moved')
+        self.stdout.write(f'Done. {cnt} attachments was moved')
@@ -0,0 +1,63 @@
+"""Кастомная команда обработки голосовых сообщений."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from chats.models import Message
+from chats.voice import process_voice_message
+
+
+class Command(BaseCommand):
+    """Команда расчёта длительности и формы волны голосовых сообщений"""
+
+    help = (
+        'Считает длительность и форму волны для голосовых сообщений, '
+        'загруженных до появления обработки. Повторный запуск безопасен'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Количество сообщений в одной партии',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Количество одновременно запущенных ffmpeg',
+        )
+
+    def process_batch(self, executor, batch):
+        futures = [
+            executor.submit(process_voice_message, pk, name)
+            for pk, name in batch
+        ]
+        for (pk, name), future in zip(batch, futures):
+            try:
+                future.result()
+            except Exception as e:
+                self.stderr.write(f'Error processing message {pk}: {e}')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Processing voice messages...')
+        pending = Message.objects.filter(
+            voice_waveform__isnull=True
+        ).exclude(voice_message='').exclude(
+            voice_message__isnull=True
+        ).order_by('pk').values_list('pk', 'voice_message')
+        cnt = 0
+        last_pk = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                batch = list(pending.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                self.process_batch(executor, batch)
+                cnt += len(batch)
+                last_pk = batch[-1][0]
+                self.stdout.write(f'{cnt} voice messages was processed')
+        self.stdout.write(f'Done. {cnt} voice messages was processed')
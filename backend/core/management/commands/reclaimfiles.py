@@ -0,0 +1,83 @@
+"""Кастомная команда удаления файлов без ссылок."""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chats.models import StoredFile, Upload
+from core.constants import PHOTO_RENDITION_SIZES
+from core.renditions import delete_renditions
+
+
+class Command(BaseCommand):
+    """Команда удаления файлов, на которые не ссылается ни одно вложение"""
+
+    help = (
+        'Удаляет партиями файлы хранилища с нулевым счётчиком ссылок '
+        'вместе с их уменьшенными копиями '
+        'и брошенные загрузки по частям. '
+        'Запускается по расписанию, повторный запуск безопасен'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество файлов в одной партии',
+        )
+        parser.add_argument(
+            '--upload-max-age',
+            type=int,
+            default=24,
+            help='Через сколько часов удалять неиспользованные загрузки',
+        )
+
+    def delete_files(self, storage, names):
+        for name in names:
+            storage.delete(name)
+            delete_renditions(name, PHOTO_RENDITION_SIZES)
+
+    def reclaim_batch(self, batch_size):
+        storage = StoredFile._meta.get_field('file').storage
+        with transaction.atomic():
+            # Строки, занятые параллельной загрузкой, пропускаем
+            batch = list(
+                StoredFile.objects.select_for_update(skip_locked=True)
+                .filter(ref_count=0)
+                .order_by('pk')
+                .values_list('pk', 'file')[:batch_size]
+            )
+            if not batch:
+                return 0
+            pks, names = zip(*batch)
+            StoredFile.objects.filter(pk__in=pks, ref_count=0).delete()
+            # Файлы удаляем только после фиксации удаления строк
+            transaction.on_commit(
+                lambda: self.delete_files(storage, names)
+            )
+        return len(batch)
+
+    def delete_stale_uploads(self, max_age):
+        # Файлы загрузок удаляются сигналом post_delete
+        deleted, _ = Upload.objects.filter(
+            date_created__lt=timezone.now() - timedelta(hours=max_age)
+        ).delete()
+        return deleted
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Reclaiming unreferenced files...')
+        cnt = 0
+        while True:
+            deleted = self.reclaim_batch(batch_size)
+            if not deleted:
+                break
+            cnt += deleted
+            self.stdout.write(f'{cnt} files was deleted')
+        self.stdout.write(f'Done. {cnt} files was deleted')
+        self.stdout.write('Deleting stale uploads...')
+        cnt = self.delete_stale_uploads(options['upload_max_age'])
+        self.stdout.write(f'{cnt} uploads was deleted')
@@ -1,6 +1,13 @@
 """Кастомная пагинация."""
 
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
 
 
 class LimitPagination(PageNumberPagination):
@@ -8,3 +15,215 @@ class LimitPagination(PageNumberPagination):
     page_query_param = 'page'
     page_size_query_param = 'limit'
     max_page_size = 1000
+
+
+class KeysetPaginationMixin:
+    """Общие настройки пагинации по ключу."""
+
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def encode_raw_cursor(self, *values):
+        raw = '|'.join(str(value) for value in values)
+        return urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_raw_cursor(self, cursor):
+        try:
+            return urlsafe_b64decode(cursor.encode()).decode().split('|')
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+
+class MessageKeysetPagination(KeysetPaginationMixin, BasePagination):
+    """
+    Пагинация сообщений по ключу (timestamp, id).
+    Параметр `before` листает историю назад, `after` догоняет новые
+    сообщения. Страница всегда отдаётся от новых сообщений к старым.
+    """
+
+    page_size = 50
+    max_page_size = 200
+    before_query_param = 'before'
+    after_query_param = 'after'
+
+    def encode_cursor(self, message):
+        return self.encode_raw_cursor(
+            message.timestamp.isoformat(), message.pk
+        )
+
+    def decode_cursor(self, cursor):
+        try:
+            timestamp, pk = self.decode_raw_cursor(cursor)
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, pk
+
+    def get_page(self, queryset, before=None, after=None, page_size=None):
+        """Вернуть страницу сообщений и курсоры для соседних страниц."""
+        page_size = page_size or self.page_size
+        if after is not None:
+            timestamp, pk = self.decode_cursor(after)
+            queryset = queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk)
+            ).order_by('timestamp', 'pk')
+        else:
+            if before is not None:
+                timestamp, pk = self.decode_cursor(before)
+                queryset = queryset.filter(
+                    Q(timestamp__lt=timestamp) |
+                    Q(timestamp=timestamp, pk__lt=pk)
+                )
+            queryset = queryset.order_by('-timestamp', '-pk')
+
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if after is not None:
+            page.reverse()
+            has_older = True
+        else:
+            has_older = has_more
+
+        if page:
+            self.before = self.encode_cursor(page[-1]) if has_older else None
+            self.after = self.encode_cursor(page[0])
+        else:
+            self.before = after
+            self.after = after
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_page(
+            queryset,
+            before=request.query_params.get(self.before_query_param),
+            after=request.query_params.get(self.after_query_param),
+            page_size=self.get_page_size(request),
+        )
+
+    def get_paginated_data(self, data):
+        return {
+            'before': self.before,
+            'after': self.after,
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'before': {'type': 'string', 'nullable': True},
+                'after': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.before_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор для загрузки более старых сообщений',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.after_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор для загрузки новых сообщений',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Количество сообщений на странице',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class MessageSearchPagination(KeysetPaginationMixin, BasePagination):
+    """
+    Пагинация результатов поиска по ключу (rank, id).
+    Результаты идут от более релевантных к менее релевантным.
+    """
+
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+
+    def encode_cursor(self, message):
+        # repr числа с плавающей точкой восстанавливается без потерь
+        return self.encode_raw_cursor(repr(message.rank), message.pk)
+
+    def decode_cursor(self, cursor):
+        try:
+            rank, pk = self.decode_raw_cursor(cursor)
+            return float(rank), int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is not None:
+            rank, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(rank__lt=rank) | Q(rank=rank, pk__lt=pk)
+            )
+        page = list(queryset.order_by('-rank', '-pk')[:page_size + 1])
+        self.next = (
+            self.encode_cursor(page[page_size - 1])
+            if len(page) > page_size else None
+        )
+        return page[:page_size]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор следующей страницы результатов',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Количество результатов на странице',
+                'schema': {'type': 'integer'},
+            },
+        ]
@@ -0,0 +1,106 @@
+"""Уменьшенные копии изображений."""
+
+import os
+import re
+import tempfile
+
+from django.core.files.storage import default_storage
+
+from PIL import Image, ImageOps, features
+
+from core.constants import RENDITION_QUALITY, RENDITIONS_DIR
+from core.tasks import run_in_background
+
+# WebP меньше по размеру, JPEG - если Pillow собран без WebP
+if features.check('webp'):
+    RENDITION_FORMAT, RENDITION_EXTENSION = 'WEBP', 'webp'
+else:
+    RENDITION_FORMAT, RENDITION_EXTENSION = 'JPEG', 'jpg'
+
+RENDITION_NAME_RE = re.compile(
+    rf'^{RENDITIONS_DIR}/(?P<name>.+)\.\d+\.(webp|jpg)$'
+)
+
+
+def get_rendition_name(name, size):
+    """
+    Имя копии выводится из имени исходного файла и размера,
+    поэтому ссылку можно построить без обращения к БД.
+    """
+    return f'{RENDITIONS_DIR}/{name}.{size}.{RENDITION_EXTENSION}'
+
+
+def get_original_name(rendition_name):
+    """Имя исходного файла копии или None, если это не копия."""
+    match = RENDITION_NAME_RE.match(rendition_name)
+    return match.group('name') if match else None
+
+
+def get_renditions(name, sizes):
+    """
+    Имена копий изображения по названиям размеров.
+    Имена выводятся из имени исходного файла без обращения
+    к хранилищу: пока копия не создана, по её ссылке
+    отдаётся исходный файл.
+    """
+    if not name:
+        return {}
+    return {
+        label: get_rendition_name(name, size)
+        for label, size in sizes.items()
+    }
+
+
+def delete_renditions(name, sizes):
+    """Удалить копии изображения, исходный файл которого удалён."""
+    for size in sizes.values():
+        default_storage.delete(get_rendition_name(name, size))
+
+
+def save_rendition(image, rendition_name):
+    path = default_storage.path(rendition_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Запись во временный файл и переименование: читатели
+    # никогда не видят недописанную копию
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path), delete=False
+    ) as tmp_file:
+        image.save(tmp_file, RENDITION_FORMAT, quality=RENDITION_QUALITY)
+    os.replace(tmp_file.name, path)
+
+
+def get_rendition_mode(image):
+    if RENDITION_FORMAT == 'WEBP' and (
+        image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    ):
+        return 'RGBA'
+    return 'RGB'
+
+
+def create_renditions(name, sizes):
+    """
+    Создать недостающие копии изображения.
+    Возвращает количество созданных копий.
+    """
+    missing = [
+        size for size in sizes.values()
+        if not default_storage.exists(get_rendition_name(name, size))
+    ]
+    if not missing:
+        return 0
+    with default_storage.open(name, 'rb') as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        mode = get_rendition_mode(image)
+        if image.mode != mode:
+            image = image.convert(mode)
+        for size in sorted(missing, reverse=True):
+            rendition = image.copy()
+            rendition.thumbnail((size, size), Image.LANCZOS)
+            save_rendition(rendition, get_rendition_name(name, size))
+    return len(missing)
+
+
+def schedule_renditions(name, sizes):
+    """Создать копии изображения в фоне после сохранения."""
+    if name:
+        run_in_background(create_renditions, name, sizes)
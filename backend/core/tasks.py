@@ -0,0 +1,40 @@
+"""Фоновые задачи в пуле потоков процесса."""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    """Пул потоков создаётся один раз на процесс при первой задаче."""
+    return ThreadPoolExecutor(
+        max_workers=settings.BACKGROUND_WORKERS,
+        thread_name_prefix='background',
+    )
+
+
+def run_task(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %s failed', func.__name__)
+    finally:
+        # У каждого потока пула своё соединение с БД
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Выполнить функцию в пуле потоков вне обработки запроса.
+    Задача ставится после фиксации текущей транзакции,
+    чтобы видеть сохранённые данные.
+    """
+    transaction.on_commit(
+        lambda: get_executor().submit(run_task, func, args, kwargs)
+    )
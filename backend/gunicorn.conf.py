@@ -0,0 +1,8 @@
+"""Настройки gunicorn, файл читается из рабочего каталога при запуске."""
+
+
+def worker_exit(server, worker):
+    """Накопленное время активности не теряется при остановке воркера."""
+    from users import presence
+
+    presence.flush()
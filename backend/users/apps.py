@@ -7,3 +7,6 @@ class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
     verbose_name = 'Приложение для описания пользователя'
+
+    def ready(self):
+        from . import signals  # noqa: F401
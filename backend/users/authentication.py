@@ -0,0 +1,48 @@
+"""Аутентификация запросов API."""
+
+from django.utils.translation import gettext_lazy as _
+
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .snapshot import get_snapshot, get_user_from_snapshot, is_revoked
+
+
+class SnapshotJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация без загрузки строки пользователя.
+    Поля для проверки прав берутся из снимка в кэше,
+    остальные поля загружаются, только если к ним обращается view.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                _('Token contained no recognizable user identification')
+            )
+
+        snapshot = get_snapshot(user_id)
+        if snapshot is None:
+            raise AuthenticationFailed(
+                _('User not found'), code='user_not_found'
+            )
+        if not snapshot['is_active']:
+            raise AuthenticationFailed(
+                _('User is inactive'), code='user_inactive'
+            )
+        if is_revoked(snapshot, validated_token.get('iat')):
+            raise AuthenticationFailed(
+                'Токен отозван.', code='token_revoked'
+            )
+        return get_user_from_snapshot(snapshot)
+
+
+class SnapshotJWTScheme(SimpleJWTScheme):
+    """Схема OpenAPI для SnapshotJWTAuthentication."""
+
+    target_class = SnapshotJWTAuthentication
@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+
+from channels.db import database_sync_to_async
+
+from chats.models import PersonalChat
+from core.constants import PRESENCE_HEARTBEAT_INTERVAL, PRESENCE_OFFLINE_DELAY
+from core.consumers import PingingWebsocketConsumer
+
+from . import presence
+
+User = get_user_model()
+
+# Ссылки на отложенные рассылки, чтобы задачи не собрал сборщик мусора
+pending_tasks = set()
+
+
+class PresenceConsumer(PingingWebsocketConsumer):
+    """
+    Канал присутствия.
+    Пользователь подписывается на статусы собеседников по личным чатам
+    и получает переходы онлайн/оффлайн. Переход в оффлайн рассылается
+    с задержкой, чтобы переподключения не доходили до подписчиков.
+    Кадры ping не отправляются: клиент присылает heartbeat.
+    """
+
+    async def connect(self):
+        user = self.scope["user"]
+        if isinstance(user, AnonymousUser):
+            await self.close()
+            return
+
+        self.user = user
+        contacts = await self.get_contacts()
+        self.groups_joined = [
+            presence.get_group_name(user_id) for user_id in contacts
+        ]
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        await self.accept()
+
+        await database_sync_to_async(presence.add_connection)(user.id)
+        await self.publish_status(True)
+        statuses = await database_sync_to_async(presence.get_statuses)(
+            list(contacts)
+        )
+        # Клиент присылает heartbeat с интервалом, который задаёт сервер
+        await self.send_frame(json.dumps({
+            'type': 'presence',
+            'heartbeat_interval': PRESENCE_HEARTBEAT_INTERVAL,
+            'users': [
+                {'slug': slug, 'is_online': statuses[user_id]}
+                for user_id, slug in contacts.items()
+            ],
+        }))
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'user'):
+            return
+        for group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        remaining = await database_sync_to_async(presence.remove_connection)(
+            self.user.id
+        )
+        if remaining <= 0:
+            task = asyncio.ensure_future(self.publish_offline_later())
+            pending_tasks.add(task)
+            task.add_done_callback(pending_tasks.discard)
+
+    async def receive_frame(self, data):
+        if data.get('type') == 'heartbeat':
+            await database_sync_to_async(presence.heartbeat)(self.user.id)
+
+    @database_sync_to_async
+    def get_contacts(self):
+        """Собеседники пользователя по личным чатам: id -> slug."""
+        pairs = PersonalChat.objects.filter(
+            Q(participant_low=self.user) | Q(participant_high=self.user)
+        ).values_list('participant_low_id', 'participant_high_id')
+        user_ids = {
+            low if high == self.user.id else high for low, high in pairs
+        }
+        user_ids.discard(None)
+        return dict(
+            User.objects.filter(pk__in=user_ids).values_list('id', 'slug')
+        )
+
+    async def publish_status(self, online):
+        changed = await database_sync_to_async(presence.set_status)(
+            self.user.id, online
+        )
+        if changed:
+            await self.channel_layer.group_send(
+                presence.get_group_name(self.user.id),
+                {
+                    'type': 'presence_update',
+                    'slug': self.user.slug,
+                    'is_online': online,
+                }
+            )
+
+    async def publish_offline_later(self):
+        await asyncio.sleep(PRESENCE_OFFLINE_DELAY)
+        if not await database_sync_to_async(presence.has_connections)(
+            self.user.id
+        ):
+            await self.publish_status(False)
+
+    async def presence_update(self, event):
+        await self.send_frame(json.dumps({
+            'type': 'presence_update',
+            'slug': event['slug'],
+            'is_online': event['is_online'],
+        }), coalesce_key=('presence', event['slug']))
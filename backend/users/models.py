@@ -1,18 +1,21 @@
 """Модели приложения users."""
 
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.core.cache import cache
 from django.db import models
 from django.db.models import Q
 from django.db.models.functions import Length
+from django.db.models.signals import post_init
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from core.constants import (EMAIL_MAX_LENGTH, FIRST_NAME_MAX_LENGTH, GENDERS,
+from core.constants import (AVATAR_RENDITION_SIZES, EMAIL_MAX_LENGTH,
+                            FIRST_NAME_MAX_LENGTH, GENDERS,
                             LANGUAGE_SKILL_LEVELS, USERNAME_MAX_LENGTH)
 from core.models import AbstractNameModel, DateCreatedModel, DateEditedModel
+from core.renditions import schedule_renditions
 
+from . import presence, snapshot
 from .validators import (custom_username_validator, validate_email,
                          validate_first_name)
 
@@ -176,13 +179,22 @@ class User(AbstractUser, DateEditedModel):
 
     objects = CustomUserManager()
 
+    def refresh_from_db(self, using=None, fields=None):
+        # Пользователь из снимка аутентификации догружается целиком
+        # при первом обращении к отложенному полю, а не по полю за запрос
+        if fields is None or not getattr(self, '_from_snapshot', False):
+            super().refresh_from_db(using=using, fields=fields)
+            return
+        self._from_snapshot = False
+        super().refresh_from_db(
+            using=using, fields=set(fields) | self.get_deferred_fields()
+        )
+        # Обработчики post_init (django_cleanup) при создании видели
+        # только поля снимка, запоминаем исходные значения файлов заново
+        post_init.send(sender=self.__class__, instance=self)
+
     def is_user_online(self):
-        last_seen = cache.get(f'last-seen-{self.id}')
-        if last_seen is not None and (
-            timezone.now() < last_seen + timezone.timedelta(seconds=300)
-        ):
-            return True
-        return False
+        return presence.is_online(self.id)
 
     def __str__(self):
         if self.first_name:
@@ -211,15 +223,19 @@ class User(AbstractUser, DateEditedModel):
         if self.id or self._state.adding:
             self.last_activity = timezone.now()
 
-            last_seen = cache.get(f'last-seen-{self.id}')
-            if last_seen is not None and (
-                timezone.now() < last_seen + timezone.timedelta(seconds=300)
-            ):
-                self.is_online = True
-            else:
-                self.is_online = False
+            self.is_online = self.is_user_online()
 
+        # Новый аватар ещё не записан в хранилище до сохранения
+        avatar_changed = bool(self.avatar) and not self.avatar._committed
+        # Смена пароля отзывает ранее выданные токены
+        password_changed = (
+            self._password is not None and not self._state.adding
+        )
         super().save(*args, **kwargs)
+        if password_changed:
+            snapshot.revoke_tokens(self.pk)
+        if avatar_changed:
+            schedule_renditions(self.avatar.name, AVATAR_RENDITION_SIZES)
 
 
 class Interest(models.Model):
@@ -0,0 +1,200 @@
+"""
+Присутствие пользователей.
+Время последней активности пишется только в кэш и в буфер процесса.
+В БД last_activity сохраняется периодически одним запросом на партию,
+остаток буфера - при остановке воркера gunicorn (gunicorn.conf.py).
+Переходы онлайн/оффлайн определяются по WebSocket-подключениям
+и рассылаются подписчикам через channel layer.
+"""
+
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from core.constants import (PRESENCE_CACHE_INTERVAL, PRESENCE_FLUSH_BATCH_SIZE,
+                            PRESENCE_FLUSH_INTERVAL, PRESENCE_TIMEOUT)
+from core.tasks import run_in_background
+
+_lock = threading.Lock()
+# id пользователя -> время последней активности, ещё не сохранённое в БД
+_pending = {}
+# id пользователя -> момент последней записи в кэш этим процессом
+_cache_written = {}
+_last_flush = time.monotonic()
+
+
+def get_cache_key(user_id):
+    return f'last-seen-{user_id}'
+
+
+def get_connections_key(user_id):
+    return f'presence-connections-{user_id}'
+
+
+def get_status_key(user_id):
+    return f'presence-status-{user_id}'
+
+
+def get_shared_cache():
+    """
+    Общий уровень кэша для счётчиков и проверок переходов.
+    Копии в памяти процесса могут отставать от других процессов,
+    поэтому горячие чтения идут через cache, а решения о переходах -
+    через общий кэш.
+    """
+    return getattr(cache, 'shared', cache)
+
+
+def get_group_name(user_id):
+    """Группа channel layer подписчиков на статус пользователя."""
+    return f'presence_{user_id}'
+
+
+def touch(user_id):
+    """
+    Отметить активность пользователя.
+    В пути запроса - не больше одной записи в кэш и никаких запросов к БД.
+    """
+    global _last_flush
+    now = timezone.now()
+    tick = time.monotonic()
+    with _lock:
+        # Время активности не уходит назад при переводе часов
+        last_seen = _pending.get(user_id)
+        if last_seen is None or last_seen < now:
+            _pending[user_id] = now
+        written = _cache_written.get(user_id, -PRESENCE_CACHE_INTERVAL)
+        write_cache = tick - written >= PRESENCE_CACHE_INTERVAL
+        if write_cache:
+            _cache_written[user_id] = tick
+        flush_due = tick - _last_flush >= PRESENCE_FLUSH_INTERVAL
+        if flush_due:
+            _last_flush = tick
+    if write_cache:
+        cache.set(get_cache_key(user_id), now, PRESENCE_TIMEOUT)
+    if flush_due:
+        run_in_background(flush)
+
+
+def get_last_seen(user_id):
+    return cache.get(get_cache_key(user_id))
+
+
+def is_online(user_id):
+    last_seen = get_last_seen(user_id)
+    return last_seen is not None and (
+        timezone.now() < last_seen + timezone.timedelta(
+            seconds=PRESENCE_TIMEOUT
+        )
+    )
+
+
+def add_connection(user_id):
+    """
+    Учесть WebSocket-подключение пользователя.
+    Счётчик живёт PRESENCE_TIMEOUT и продлевается heartbeat,
+    поэтому подключения упавшего процесса со временем истекают.
+    """
+    touch(user_id)
+    key = get_connections_key(user_id)
+    shared_cache = get_shared_cache()
+    shared_cache.add(key, 0, PRESENCE_TIMEOUT)
+    try:
+        return shared_cache.incr(key)
+    except ValueError:
+        # Ключ истёк между add и incr
+        shared_cache.set(key, 1, PRESENCE_TIMEOUT)
+        return 1
+
+
+def remove_connection(user_id):
+    """Возвращает количество оставшихся подключений пользователя."""
+    try:
+        return get_shared_cache().decr(get_connections_key(user_id))
+    except ValueError:
+        return 0
+
+
+def heartbeat(user_id):
+    touch(user_id)
+    get_shared_cache().touch(get_connections_key(user_id), PRESENCE_TIMEOUT)
+
+
+def has_connections(user_id):
+    return (get_shared_cache().get(get_connections_key(user_id)) or 0) > 0
+
+
+def set_status(user_id, online):
+    """
+    Запомнить статус пользователя для рассылки.
+    Возвращает False, если статус не изменился: повторные подключения
+    не рассылаются подписчикам.
+    """
+    key = get_status_key(user_id)
+    if get_shared_cache().get(key, False) == online:
+        return False
+    cache.set(key, online, None)
+    # Переходы редкие, хранимый флаг обновляется только на них
+    get_user_model().objects.filter(pk=user_id).update(is_online=online)
+    return True
+
+
+def get_statuses(user_ids):
+    """Статусы пользователей: подключены по WebSocket или активны недавно."""
+    statuses = cache.get_many([get_status_key(pk) for pk in user_ids])
+    return {
+        pk: statuses.get(get_status_key(pk), False) or is_online(pk)
+        for pk in user_ids
+    }
+
+
+def save_last_activity(batch):
+    """Сохранить last_activity партии пользователей одним запросом."""
+    user_model = get_user_model()
+    if connection.vendor != 'postgresql':
+        user_model.objects.filter(pk__in=batch).update(last_activity=Greatest(
+            'last_activity',
+            Case(*(
+                When(pk=user_id, then=Value(last_seen))
+                for user_id, last_seen in batch.items()
+            ))
+        ))
+        return
+    table = connection.ops.quote_name(user_model._meta.db_table)
+    pk = connection.ops.quote_name(user_model._meta.pk.column)
+    column = connection.ops.quote_name(
+        user_model._meta.get_field('last_activity').column
+    )
+    values = ', '.join(['(%s, %s::timestamptz)'] * len(batch))
+    params = [value for item in batch.items() for value in item]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} AS u '
+            f'SET {column} = GREATEST(u.{column}, v.last_seen) '
+            f'FROM (VALUES {values}) AS v(id, last_seen) '
+            f'WHERE u.{pk} = v.id',
+            params
+        )
+
+
+def flush():
+    """Сохранить накопленное время активности в БД."""
+    tick = time.monotonic()
+    with _lock:
+        pending = _pending.copy()
+        _pending.clear()
+        for user_id, written in list(_cache_written.items()):
+            if tick - written >= PRESENCE_CACHE_INTERVAL:
+                del _cache_written[user_id]
+    items = list(pending.items())
+    for start in range(0, len(items), PRESENCE_FLUSH_BATCH_SIZE):
+        save_last_activity(
+            dict(items[start:start + PRESENCE_FLUSH_BATCH_SIZE])
+        )
+    return len(items)
@@ -1,14 +1,18 @@
 """Сериализаторы приложения users."""
 
-from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.utils import timezone
 
 from djoser.serializers import UserCreateSerializer as DjoserCreateSerializer
 from djoser.serializers import UserSerializer as DjoserSerializer
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
-from core.constants import (MAX_AGE, MAX_FOREIGN_LANGUAGES,
-                            MAX_NATIVE_LANGUAGES, MIN_AGE)
+from core.constants import (AVATAR_RENDITION_SIZES, MAX_AGE,
+                            MAX_FOREIGN_LANGUAGES, MAX_NATIVE_LANGUAGES,
+                            MIN_AGE)
+from core.renditions import get_renditions
+from users import presence
 from users.fields import Base64ImageField, CreatableSlugRelatedField
 from users.models import (BlacklistEntry, Country, Goal, Interest, Language,
                           Report, User, UserLanguage)
@@ -144,10 +148,7 @@ class UserReprSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_is_online(self, obj):
-        last_seen = cache.get(f'last-seen-{obj.id}')
-        return last_seen is not None and (
-            timezone.now() < last_seen + timezone.timedelta(seconds=300)
-        )
+        return presence.is_online(obj.id)
 
     def get_age(self, obj):
         """Вычисление возраста пользователя."""
@@ -269,6 +270,8 @@ class UserProfileSerializer(DjoserSerializer, UserReprSerializer):
 
 
 class UserShortSerializer(serializers.ModelSerializer):
+    avatar_renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = User
         fields = (
@@ -276,9 +279,24 @@ class UserShortSerializer(serializers.ModelSerializer):
             'username',
             'first_name',
             'avatar',
+            'avatar_renditions',
         )
         read_only_fields = fields
 
+    @extend_schema_field(serializers.DictField(child=serializers.URLField()))
+    def get_avatar_renditions(self, obj):
+        """Ссылки на уменьшенные копии аватара."""
+        request = self.context.get('request')
+        renditions = {}
+        for label, name in get_renditions(
+            obj.avatar.name, AVATAR_RENDITION_SIZES
+        ).items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            renditions[label] = url
+        return renditions
+
 
 class BlacklistEntrySerializer(serializers.ModelSerializer):
     """Сериализатор блокировки"""
@@ -0,0 +1,27 @@
+"""Сигналы приложения users."""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from django_cleanup.signals import cleanup_post_delete
+
+from core.constants import AVATAR_RENDITION_SIZES
+from core.renditions import delete_renditions
+
+from .models import User
+from .snapshot import invalidate_snapshot
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def reset_user_snapshot(sender, instance, **kwargs):
+    """Сбросить снимок пользователя, закэшированный для аутентификации."""
+    invalidate_snapshot(instance.pk)
+
+
+@receiver(cleanup_post_delete, sender=User)
+def remove_avatar_renditions(sender, field_name, file_name, success,
+                             **kwargs):
+    """Удалить уменьшенные копии заменённого или удалённого аватара."""
+    if field_name == 'avatar' and success:
+        delete_renditions(file_name, AVATAR_RENDITION_SIZES)
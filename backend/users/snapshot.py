@@ -0,0 +1,97 @@
+"""
+Снимок пользователя для аутентификации.
+Проверка токена не ходит в таблицу пользователей: нужные для прав
+поля берутся из кэша, остальные догружаются при первом обращении.
+Снимок сбрасывается при сохранении и удалении пользователя,
+поэтому деактивация и отзыв токенов действуют сразу.
+"""
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from rest_framework_simplejwt.settings import api_settings
+
+from core.constants import USER_SNAPSHOT_TIMEOUT
+
+SNAPSHOT_FIELDS = ('id', 'slug', 'role', 'is_staff', 'is_active')
+
+
+def get_snapshot_key(user_id):
+    return f'user-snapshot-{user_id}'
+
+
+def get_revoked_key(user_id):
+    return f'tokens-revoked-{user_id}'
+
+
+def get_snapshot(user_id):
+    """Поля снимка пользователя или None, если пользователя нет."""
+    key = get_snapshot_key(user_id)
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        return snapshot
+    snapshot = get_user_model().objects.filter(
+        pk=user_id
+    ).values(*SNAPSHOT_FIELDS).first()
+    if snapshot is not None:
+        # Отметка отзыва хранится в снимке, чтобы не читать её
+        # из общего кэша на каждый запрос
+        snapshot['tokens_revoked_at'] = cache.get(get_revoked_key(user_id))
+        cache.set(key, snapshot, USER_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def invalidate_snapshot(user_id):
+    cache.delete(get_snapshot_key(user_id))
+
+
+def revoke_tokens(user_id):
+    """
+    Отозвать все токены, выданные пользователю до этого момента.
+    Access-токен, полученный по старому refresh-токену, наследует его iat,
+    поэтому отметка живёт до истечения всех выданных refresh-токенов.
+    iat токена - целые секунды, отметка округляется так же:
+    вход в ту же секунду после смены пароля не должен быть отозван.
+    """
+    cache.set(
+        get_revoked_key(user_id),
+        int(time.time()),
+        api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()
+    )
+    invalidate_snapshot(user_id)
+
+
+def is_revoked(snapshot, issued_at):
+    revoked_at = snapshot.get('tokens_revoked_at')
+    return revoked_at is not None and (
+        issued_at is None or issued_at < revoked_at
+    )
+
+
+def get_user_from_snapshot(snapshot):
+    """
+    Пользователь с полями снимка, остальные поля отложены.
+    Первое обращение к отложенному полю загружает их все одним запросом.
+    """
+    user_model = get_user_model()
+    field_names = [
+        field.attname for field in user_model._meta.concrete_fields
+        if field.attname in snapshot
+    ]
+    user = user_model.from_db(
+        'default', field_names, [snapshot[name] for name in field_names]
+    )
+    user._from_snapshot = True
+    return user
+
+
+def get_user(user_id, issued_at=None):
+    """Активный пользователь с неотозванным токеном или None."""
+    snapshot = get_snapshot(user_id)
+    if snapshot is None or not snapshot['is_active']:
+        return None
+    if is_revoked(snapshot, issued_at):
+        return None
+    return get_user_from_snapshot(snapshot)
@@ -0,0 +1,38 @@
+"""Тесты приложения users."""
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from users import presence
+
+User = get_user_model()
+
+
+class PresenceFlushTest(TestCase):
+    """Время активности сохраняется в БД только при сбросе буфера."""
+
+    def setUp(self):
+        # Буфер процесса общий для всех тестов
+        presence.flush()
+        self.user = User.objects.create_user(
+            'user', 'user@example.com', 'password'
+        )
+        User.objects.filter(pk=self.user.pk).update(
+            last_activity=timezone.now() - timezone.timedelta(days=1)
+        )
+        self.addCleanup(presence.flush)
+
+    def get_last_activity(self):
+        return User.objects.values_list('last_activity', flat=True).get(
+            pk=self.user.pk
+        )
+
+    def test_flush_saves_pending_activity(self):
+        before = self.get_last_activity()
+        with self.assertNumQueries(0):
+            presence.touch(self.user.pk)
+        self.assertEqual(self.get_last_activity(), before)
+        self.assertEqual(presence.flush(), 1)
+        self.assertGreater(self.get_last_activity(), before)
+        self.assertEqual(presence.flush(), 0)
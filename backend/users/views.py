@@ -124,12 +124,10 @@ class UserViewSet(DjoserViewSet):
         instance = self.get_object()
         current_user = request.user
 
-        blocked_chats = PersonalChat.objects.filter(
-            Q(initiator=instance, blocked_users=current_user) |
-            Q(receiver=instance, blocked_users=current_user)
-        )
-
-        if blocked_chats.exists():
+        if current_user.is_authenticated and PersonalChat.objects.filter(
+            **PersonalChat.get_pair_lookup(instance, current_user),
+            blocked_users=current_user
+        ).exists():
             raise PermissionDenied(
                 "Вы заблокированы и не можете просматривать этот профиль.")
 